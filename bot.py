@@ -1,181 +1,2137 @@
+import time
+
+_BOOT_STARTED = time.perf_counter()
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import Interaction, app_commands
 from discord.ui import Select, View
-import random
 import aiosqlite
 import datetime
 import re
+import math
 from discord.ui import View, Select, Modal, TextInput, Button
 from datetime import timedelta
-import uuid
+import io
+import base64
+import secrets
+import asyncio
+import os
+import codecs
+import csv
+import gzip
+import hashlib
+import tempfile
+import json
+import argparse
+import signal
+import sys
+import aiohttp
+import traceback
+import contextvars
+import functools
+from aiohttp import web
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
 from typing import Optional
 
+try:
+    import asyncpg
+except ImportError:
+    # Optional: only needed when DATABASE_URL points at Postgres
+    asyncpg = None
+
+DB_FILE = "database/bot_data.db"
+DB_READERS = 4
+
+# Serve /generate from in-memory queues of pre-leased accounts (see DispenseEngine)
+DISPENSE_PREFETCH = False
+
+# Set to a postgres:// DSN to keep accounts, keys, admins and stats in Postgres (needs asyncpg).
+# The local SQLite file still holds bot metadata
+DATABASE_URL = os.environ.get("DATABASE_URL")
+POSTGRES_POOL_SIZE = 10
+
+# "local" runs dispense/activate/key writes in this process. "coordinator" forwards them to
+# `python bot.py coordinator`, which owns the database, so several shard processes can share it
+STORAGE_BACKEND = os.environ.get("BOT_STORAGE", "local")
+COORDINATOR_SOCKET = "database/coordinator.sock"
+
+# Set both to run this process as one shard of a multi-process deployment
+SHARD_ID = os.environ.get("BOT_SHARD_ID")
+SHARD_COUNT = os.environ.get("BOT_SHARD_COUNT")
+
+# Prometheus scrape endpoint; bound to localhost only. Each shard process serves on the base
+# port + its shard id. BOT_METRICS_PORT overrides METRICS_PORT; "off" disables it
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+def metrics_port() -> int | None:
+    """Base metrics port from BOT_METRICS_PORT, read at startup. None when metrics are off."""
+    value = os.environ.get("BOT_METRICS_PORT", str(METRICS_PORT)).strip()
+    if value == "off":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Ignoring malformed BOT_METRICS_PORT {value!r}; metrics are off")
+        return None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class CounterMetric:
+    """Monotonic counter keyed by label set."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self.series.get(_label_key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+class HistogramMetric:
+    """Cumulative-bucket histogram keyed by label set, in Prometheus layout."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self.series.get(_label_key(labels))
+        return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """
+    Process-local metrics rendered in the Prometheus text format.
+
+    Counters and histograms are updated inline; gauges are collected at scrape time
+    by async callbacks returning {labels dict as tuple: value}, so they never go stale.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []
+
+    def counter(self, name: str, help_text: str) -> CounterMetric:
+        metric = CounterMetric(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> HistogramMetric:
+        metric = HistogramMetric(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str):
+        """Decorator registering an async collector for a gauge."""
+        def decorator(collect):
+            self._gauges.append((name, help_text, collect))
+            return collect
+        return decorator
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, collect in self._gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                samples = await collect()
+            except Exception as e:
+                # One broken collector must not take down the whole scrape
+                print(f"Metrics collector {name} failed: {e}")
+                continue
+            for key, value in sorted(samples.items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+command_invocations = metrics.counter("bot_command_invocations_total", "Commands invoked, by command.")
+command_errors = metrics.counter("bot_command_errors_total", "Commands that raised, by command.")
+command_latency = metrics.histogram("bot_command_duration_seconds", "Wall-clock command latency.")
+command_sqlite_time = metrics.histogram("bot_command_sqlite_seconds", "Time per command spent waiting on or holding SQLite connections.")
+command_discord_time = metrics.histogram("bot_command_discord_seconds", "Time per command spent in Discord API requests.")
+dispenses_total = metrics.counter("bot_dispenses_total", "Accounts handed out, by platform.")
+
+# Per-invocation time accumulators; set by instrumented() and read by the pool and HTTP hooks
+_command_span = contextvars.ContextVar("command_span", default=None)
+
+def _record_span(field: str, elapsed: float):
+    span = _command_span.get()
+    if span is not None:
+        span[field] += elapsed
+
+def instrumented(name: str, callback):
+    """Wraps a command callback to record invocations, errors, latency and the SQLite/Discord split."""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        span = {"sqlite": 0.0, "discord": 0.0}
+        token = _command_span.set(span)
+        started = time.perf_counter()
+        command_invocations.inc(command=name)
+        try:
+            return await callback(*args, **kwargs)
+        except BaseException:
+            command_errors.inc(command=name)
+            raise
+        finally:
+            _command_span.reset(token)
+            command_latency.observe(time.perf_counter() - started, command=name)
+            command_sqlite_time.observe(span["sqlite"], command=name)
+            command_discord_time.observe(span["discord"], command=name)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_commands(client: commands.Bot):
+    """
+    Wraps every registered slash and prefix command, and the persistent component callbacks.
+    Safe to call more than once.
+    """
+    for command in list(client.tree.walk_commands()) + list(client.walk_commands()):
+        if isinstance(command, app_commands.Group):
+            continue
+        if getattr(command._callback, "__instrumented__", False):
+            continue
+        # Assign _callback directly: the public setter on prefix commands re-parses the signature
+        command._callback = instrumented(command.qualified_name, command._callback)
+    for component in PERSISTENT_COMPONENTS:
+        if not getattr(component.callback, "__instrumented__", False):
+            component.callback = instrumented(component.__name__, component.callback)
+
+# Command bodies run in at most this many slots; everything past that queues by priority
+COMMAND_WORKERS = 8
+# Discord fails an interaction that is not acknowledged within 3 seconds
+INTERACTION_DEADLINE = 3.0
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ("interactive", "admin", "bulk")
+# Most slots each class may hold at once, so long admin and bulk work always leaves room for users
+PRIORITY_LIMITS = (COMMAND_WORKERS, COMMAND_WORKERS - 2, 2)
+
+command_queue_wait = metrics.histogram("bot_command_queue_wait_seconds", "Time commands waited for an executor slot, by priority.")
+command_deadline_misses = metrics.counter("bot_command_deadline_misses_total", "Interactions acknowledged after Discord's 3 second deadline, by command.")
+
+class CommandExecutor:
+    """
+    Admits command bodies into a fixed number of slots, most urgent class first.
+
+    A slot is a permit rather than a worker task, so the command keeps running in its own
+    task (and keeps its metrics span). A freed slot goes to the oldest waiter of the most
+    urgent class that is still under its PRIORITY_LIMITS cap.
+    """
+
+    def __init__(self, slots: int = COMMAND_WORKERS, limits: tuple = PRIORITY_LIMITS):
+        self.slots = slots
+        self.limits = limits
+        self.running = [0] * len(limits)
+        self._waiters = [deque() for _ in limits]
+
+    def queued(self, priority: int) -> int:
+        return len(self._waiters[priority])
+
+    def _admissible(self, priority: int) -> bool:
+        return sum(self.running) < self.slots and self.running[priority] < self.limits[priority]
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        started = time.perf_counter()
+        # Only skip the queue when nobody at this or a more urgent class is already waiting
+        if self._admissible(priority) and not any(self._waiters[p] for p in range(priority + 1)):
+            self.running[priority] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters[priority].append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Handed a slot just as we were cancelled: pass it on
+                    self._release(priority)
+                else:
+                    self._waiters[priority].remove(future)
+                raise
+        command_queue_wait.observe(time.perf_counter() - started, priority=PRIORITY_NAMES[priority])
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def _release(self, priority: int):
+        self.running[priority] -= 1
+        for waiting, waiters in enumerate(self._waiters):
+            while waiters and self._admissible(waiting):
+                self.running[waiting] += 1
+                waiters.popleft().set_result(None)
+
+command_executor = CommandExecutor()
+
+class DeferredResponse:
+    """Stands in for interaction.response once the interaction is deferred: replies become followups."""
+
+    def __init__(self, interaction: Interaction, ephemeral: bool = True):
+        self._interaction = interaction
+        # The first followup takes over the "thinking" message, visibility included
+        self._public_thinking = not ephemeral
+
+    def is_done(self) -> bool:
+        return True
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_message(self, content=None, **kwargs):
+        # Webhook sends reject None for view/embed and friends, where send_message treated it as "unset"
+        kwargs = {name: value for name, value in kwargs.items() if value is not None}
+        if self._public_thinking:
+            self._public_thinking = False
+            if kwargs.get("ephemeral"):
+                # Drop the public placeholder so this reply goes out as a new, ephemeral message
+                await self._interaction.delete_original_response()
+        await self._interaction.followup.send(content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self._interaction.edit_original_response(**kwargs)
+
+class DeferredInteraction:
+    """Proxy handed to scheduled command bodies, so they keep calling interaction.response as before."""
+
+    def __init__(self, interaction: Interaction, ephemeral: bool = True):
+        self._interaction = interaction
+        self.response = DeferredResponse(interaction, ephemeral)
+
+    def __getattr__(self, name):
+        return getattr(self._interaction, name)
+
+async def acknowledge(name: str, interaction: Interaction, ephemeral: bool, thinking: bool) -> bool:
+    """Defers `interaction` and records a deadline miss if Discord had given up. Returns whether it was acknowledged."""
+    try:
+        await interaction.response.defer(ephemeral=ephemeral, thinking=thinking)
+    except discord.NotFound:
+        # Unknown interaction: the user has already been shown "The application did not respond"
+        command_deadline_misses.inc(command=name)
+        print(f"Interaction for {name} expired before it was deferred.")
+        return False
+    created_at = getattr(interaction, "created_at", None)
+    if created_at is not None and (discord.utils.utcnow() - created_at).total_seconds() > INTERACTION_DEADLINE:
+        command_deadline_misses.inc(command=name)
+    return True
+
+def scheduled(name: str, callback, priority: int, *, defer: bool = True, ephemeral: bool = True,
+              thinking: bool = True, method: bool = False):
+    """
+    Wraps a command or component callback to defer its interaction right away, then run the
+    body in a command_executor slot of `priority`. Prefix commands pass defer=False.
+    """
+    index = 1 if method else 0
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        if defer:
+            interaction = args[index]
+            if not await acknowledge(name, interaction, ephemeral, thinking):
+                return
+            args = args[:index] + (DeferredInteraction(interaction, ephemeral),) + args[index + 1:]
+        async with command_executor.slot(priority):
+            return await callback(*args, **kwargs)
+    wrapper.__scheduled__ = True
+    return wrapper
+
+# Commands run through command_executor, by qualified name. Unlisted ones (generate_key, which
+# only shows a menu) still answer inline
+COMMAND_PRIORITIES = {
+    "generate": PRIORITY_INTERACTIVE,
+    "activate": PRIORITY_INTERACTIVE,
+    "stats": PRIORITY_INTERACTIVE,
+    "key_info": PRIORITY_INTERACTIVE,
+    "platform-create": PRIORITY_ADMIN,
+    "add_account": PRIORITY_ADMIN,
+    "admin_user": PRIORITY_ADMIN,
+    "admin_role": PRIORITY_ADMIN,
+    "blacklist": PRIORITY_ADMIN,
+    "remove_blacklist": PRIORITY_ADMIN,
+    "key-addtime": PRIORITY_ADMIN,
+    "edit_cooldown": PRIORITY_ADMIN,
+    "dispense_stats": PRIORITY_ADMIN,
+    "cache_stats": PRIORITY_ADMIN,
+    "inventory_check": PRIORITY_ADMIN,
+    "jobs": PRIORITY_ADMIN,
+    "revoke-key": PRIORITY_ADMIN,
+    "bulk_add": PRIORITY_BULK,
+    "keys_viewall": PRIORITY_BULK,
+    "export": PRIORITY_BULK,
+    "bulk-key-create": PRIORITY_BULK,
+}
+# Visibility is fixed when deferring, so these post in the channel like their success replies did;
+# DeferredResponse still sends their ephemeral replies (refusals, validation errors) privately
+PUBLIC_COMMANDS = {"platform-create", "add_account", "blacklist", "remove_blacklist", "keys_viewall"}
+
+def schedule_commands(client: commands.Bot):
+    """
+    Routes the commands in COMMAND_PRIORITIES and the components in COMPONENT_PRIORITIES
+    through command_executor. Call before instrument_commands. Safe to call more than once.
+    """
+    for command in client.tree.walk_commands():
+        name = command.qualified_name
+        if isinstance(command, app_commands.Group) or name not in COMMAND_PRIORITIES:
+            continue
+        if not getattr(command._callback, "__scheduled__", False):
+            command._callback = scheduled(name, command._callback, COMMAND_PRIORITIES[name],
+                                          ephemeral=name not in PUBLIC_COMMANDS)
+    for command in client.walk_commands():
+        name = command.qualified_name
+        if name in COMMAND_PRIORITIES and not getattr(command._callback, "__scheduled__", False):
+            command._callback = scheduled(name, command._callback, COMMAND_PRIORITIES[name], defer=False)
+    for component, (priority, thinking) in COMPONENT_PRIORITIES.items():
+        if not getattr(component.callback, "__scheduled__", False):
+            component.callback = scheduled(component.__name__, component.callback, priority,
+                                           thinking=thinking, method=True)
+
+def _timed_request(request):
+    @functools.wraps(request)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            _record_span("discord", time.perf_counter() - started)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_discord_http():
+    """Times REST calls and interaction responses (which go through the webhook adapter)."""
+    from discord.http import HTTPClient
+    from discord.webhook.async_ import AsyncWebhookAdapter
+    for cls in (HTTPClient, AsyncWebhookAdapter):
+        if not getattr(cls.request, "__instrumented__", False):
+            cls.request = _timed_request(cls.request)
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serves GET /metrics on the bot's own event loop."""
+    async def handle_metrics(request):
+        body = await metrics.render()
+        return web.Response(text=body, content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    return runner
+
+class DatabasePool:
+    """
+    Bot-owned aiosqlite connections: one writer plus a fixed set of readers.
+
+    Opening a connection spawns a worker thread and re-opens the SQLite file, so
+    commands borrow a long-lived connection instead of calling aiosqlite.connect.
+    The database runs in WAL mode, which lets readers proceed while the writer
+    holds its transaction.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA cache_size = -16000",
+        "PRAGMA mmap_size = 134217728",
+        "PRAGMA foreign_keys = ON",
+    )
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.reader_count = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+
+    async def _connect(self):
+        # cached_statements keeps prepared statements alive across calls on the same connection
+        db = await aiosqlite.connect(self.path, cached_statements=256)
+        for pragma in self.PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer = await self._connect()
+        for _ in range(self.reader_count):
+            reader = await self._connect()
+            # Readers never write; this also stops a stray write from taking the lock
+            await reader.execute("PRAGMA query_only = ON")
+            self._all_readers.append(reader)
+            self._readers.put_nowait(reader)
+
+    async def close(self):
+        for reader in self._all_readers:
+            await reader.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self):
+        """Borrows a read-only connection for the duration of the block."""
+        started = time.perf_counter()
+        reader = await self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put_nowait(reader)
+            _record_span("sqlite", time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def write(self):
+        """Borrows the single writer connection. Uncommitted work is rolled back on error."""
+        started = time.perf_counter()
+        try:
+            async with self._write_lock:
+                try:
+                    yield self._writer
+                except BaseException:
+                    await self._writer.rollback()
+                    raise
+        finally:
+            _record_span("sqlite", time.perf_counter() - started)
+
 class MyBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix="/", intents=intents)
+        shard_options = {}
+        if SHARD_ID is not None and SHARD_COUNT is not None:
+            shard_options = {"shard_id": int(SHARD_ID), "shard_count": int(SHARD_COUNT)}
+        super().__init__(command_prefix="/", intents=intents, **shard_options)
+        self.db = DatabasePool(DB_FILE)
+        self.stores = None
+        self.storage = None
+        self.dispenser = None
+        self.metrics_runner = None
+        self.dedupe_task = None
+        self.job_store = None
+        self.jobs = None
+        self.startup = StartupTimer(_BOOT_STARTED)
 
     async def setup_hook(self):
-        await self.tree.sync()
-        print("Slash commands synchronized.")
+        # Runs once per process, unlike on_ready which fires again after every reconnect
+        self.startup.mark("login")
+        await self.db.open()
+        self.startup.mark("db open")
+        owns_database = STORAGE_BACKEND != "coordinator"
+        if owns_database:
+            await initialize_database()
+            self.startup.mark("migrations")
+        self.stores = await open_stores(self.db)
+        if owns_database:
+            self.storage = LocalStorage(self.stores)
+        else:
+            # The coordinator migrates the schema and owns every write that must not race
+            self.storage = CoordinatorStorage(COORDINATOR_SOCKET)
+        await self.storage.open()
+        await admin_cache.load(self.stores.admins)
+        self.job_store = JobStore(self.db)
+        self.jobs = JobRunner(self.job_store)
+        if owns_database:
+            await cooldown_tracker.load(self.stores.stats)
+            # Postgres dispenses with SKIP LOCKED, so the SQLite lease queues are not needed
+            if DISPENSE_PREFETCH and not DATABASE_URL:
+                self.dispenser = DispenseEngine(self.db)
+                await self.dispenser.start()
+        self.startup.mark("caches")
+        self.add_dynamic_items(*PERSISTENT_COMPONENTS)
+        schedule_commands(self)
+        instrument_commands(self)
+        instrument_discord_http()
+        base_port = metrics_port()
+        if base_port is not None:
+            port = base_port + int(SHARD_ID or 0)
+            try:
+                self.metrics_runner = await start_metrics_server(METRICS_HOST, port)
+                print(f"Metrics served on http://{METRICS_HOST}:{port}/metrics")
+            except OSError as e:
+                # Scraping is optional; a taken port must not stop the bot from starting
+                print(f"Metrics server not started on port {port}: {e}")
+        flush_event_journal.start()
+        if owns_database:
+            sweep_expired_keys.start()
+            flush_cooldowns.start()
+            flush_generated_stats.start()
+            backup_snapshots.start()
+            self.dedupe_task = asyncio.create_task(dedupe_accounts(self.stores.accounts))
+        # With several shard processes, shard 0 runs the jobs they all queue
+        if owns_database or int(SHARD_ID or 0) == 0:
+            self.jobs.start()
+        if await sync_command_tree(self):
+            print("Slash commands synchronized.")
+            self.startup.mark("command sync")
+        else:
+            print("Slash commands unchanged; skipped sync.")
+            self.startup.mark("command sync (skipped)")
+
+    async def close(self):
+        await super().close()
+        sweep_expired_keys.cancel()
+        flush_cooldowns.cancel()
+        flush_generated_stats.cancel()
+        flush_event_journal.cancel()
+        backup_snapshots.cancel()
+        if self.dedupe_task is not None:
+            self.dedupe_task.cancel()
+        if self.jobs is not None:
+            await self.jobs.close()
+        if self.dispenser is not None:
+            await self.dispenser.close()
+        if self.stores is not None:
+            if cooldown_tracker.loaded:
+                await cooldown_tracker.flush(self.stores.stats)
+            await generated_stats_buffer.flush(self.stores.stats)
+            await event_journal.flush(self.stores.stats)
+        if self.storage is not None:
+            await self.storage.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+        if self.stores is not None:
+            await self.stores.close()
+        await self.db.close()
+
+class StartupTimer:
+    """Wall-clock time of each boot phase, measured from the start of the module import."""
+
+    def __init__(self, started: float):
+        self._last = started
+        self.started = started
+        self.phases = []
+        self.reported = False
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        lines = [f"  {phase:<24}{elapsed * 1000:9.1f}ms" for phase, elapsed in self.phases]
+        lines.append(f"  {'total':<24}{(self._last - self.started) * 1000:9.1f}ms")
+        return "Startup timing:\n" + "\n".join(lines)
+
+def command_tree_hash(tree: app_commands.CommandTree) -> str:
+    """Stable digest of the global command payload that tree.sync() would upload."""
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands()),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_command_tree(client: commands.Bot) -> bool:
+    """
+    Syncs global commands only when the local tree differs from the last one synced for
+    this application. Returns whether a sync happened. Delete the bot_meta row to force one.
+    """
+    meta_key = f"command_tree_hash:{client.application_id}"
+    digest = command_tree_hash(client.tree)
+    async with client.db.read() as db:
+        async with db.execute("SELECT value FROM bot_meta WHERE key = ?", (meta_key,)) as cursor:
+            row = await cursor.fetchone()
+    if row is not None and row[0] == digest:
+        return False
+
+    await client.tree.sync()
+    # Only recorded after a successful sync, so a failed one is retried on the next boot
+    async with client.db.write() as db:
+        await db.execute(
+            "INSERT INTO bot_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (meta_key, digest)
+        )
+        await db.commit()
+    return True
 
 # Initialize bot
 bot = MyBot()
 
-DB_FILE = "database/bot_data.db"
-
 # Initialize database
 
+async def _migration_initial_schema(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, platform TEXT NOT NULL, account TEXT NOT NULL)")
+    await db.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, expiration TEXT NOT NULL, user_id INTEGER, duration TEXT NOT NULL, cooldown INTEGER NOT NULL)")
+    await db.execute("CREATE TABLE IF NOT EXISTS generated_stats (user_id INTEGER PRIMARY KEY, generated_count INTEGER DEFAULT 0)")
+    await db.execute("CREATE TABLE IF NOT EXISTS admin_users (user_id INTEGER PRIMARY KEY)")
+    await db.execute("CREATE TABLE IF NOT EXISTS admin_roles (role_id INTEGER PRIMARY KEY)")
+    await db.execute("CREATE TABLE IF NOT EXISTS blacklisted_users (user_id INTEGER PRIMARY KEY)")
+    await db.execute("CREATE TABLE IF NOT EXISTS platforms (platform TEXT PRIMARY KEY)")
+
+async def _migration_account_leases(db):
+    # Accounts reserved by the prefetching dispenser carry a lease timestamp.
+    # Databases touched before versioning may already have the column.
+    async with db.execute("PRAGMA table_info(accounts)") as cursor:
+        account_columns = [row[1] for row in await cursor.fetchall()]
+    if "leased_at" not in account_columns:
+        await db.execute("ALTER TABLE accounts ADD COLUMN leased_at INTEGER")
+
+async def _migration_hot_query_indexes(db):
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_accounts_platform ON accounts (platform)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_keys_user_id ON keys (user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_keys_expiration ON keys (expiration)")
+
+async def _migration_platform_inventory(db):
+    # Per-platform stock counters kept in step with accounts by triggers, so every
+    # insert or delete path (add_account, bulk_add, dispenses) maintains them transactionally
+    await db.execute("CREATE TABLE IF NOT EXISTS platform_inventory (platform TEXT PRIMARY KEY, available INTEGER NOT NULL DEFAULT 0)")
+    await db.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_accounts_inventory_insert AFTER INSERT ON accounts BEGIN "
+        "INSERT INTO platform_inventory (platform, available) VALUES (NEW.platform, 1) "
+        "ON CONFLICT(platform) DO UPDATE SET available = available + 1; END"
+    )
+    await db.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_accounts_inventory_delete AFTER DELETE ON accounts BEGIN "
+        "UPDATE platform_inventory SET available = available - 1 WHERE platform = OLD.platform; END"
+    )
+    await db.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_accounts_inventory_update AFTER UPDATE OF platform ON accounts "
+        "WHEN NEW.platform IS NOT OLD.platform BEGIN "
+        "UPDATE platform_inventory SET available = available - 1 WHERE platform = OLD.platform; "
+        "INSERT INTO platform_inventory (platform, available) VALUES (NEW.platform, 1) "
+        "ON CONFLICT(platform) DO UPDATE SET available = available + 1; END"
+    )
+    await rebuild_platform_inventory(db)
+
+async def rebuild_platform_inventory(db) -> dict[str, tuple[int, int]]:
+    """
+    Recounts platform_inventory from the accounts table inside the caller's transaction.
+    Returns {platform: (counted, actual)} for every counter that had drifted.
+    """
+    async with db.execute("SELECT platform, available FROM platform_inventory") as cursor:
+        counted = dict(await cursor.fetchall())
+    async with db.execute("SELECT platform, COUNT(*) FROM accounts GROUP BY platform") as cursor:
+        actual = dict(await cursor.fetchall())
+
+    drift = {
+        platform: (counted.get(platform, 0), actual.get(platform, 0))
+        for platform in counted.keys() | actual.keys()
+        if counted.get(platform, 0) != actual.get(platform, 0)
+    }
+    await db.execute("DELETE FROM platform_inventory")
+    await db.executemany("INSERT INTO platform_inventory (platform, available) VALUES (?, ?)", actual.items())
+    return drift
+
+async def _migration_account_lookup_index(db):
+    # Lets bulk_add check already-stocked rows; platform-only lookups use its prefix
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_accounts_platform_account ON accounts (platform, account)")
+    await db.execute("DROP INDEX IF EXISTS idx_accounts_platform")
+
+async def _migration_dispense_cooldowns(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS dispense_cooldowns (user_id INTEGER PRIMARY KEY, last_dispense REAL NOT NULL, cooldown INTEGER NOT NULL)")
+
+async def _migration_epoch_key_expiration(db):
+    # Store expiration as integer epoch seconds, NULL for lifetime keys (the old TEXT NOT NULL
+    # column could not hold lifetime keys at all). ISO strings were written in local time.
+    # Unparseable values become 0, i.e. already expired, rather than silently lifetime.
+    await db.execute("CREATE TABLE keys_new (key TEXT PRIMARY KEY, expiration INTEGER, user_id INTEGER, duration TEXT NOT NULL, cooldown INTEGER NOT NULL)")
+    await db.execute(
+        "INSERT INTO keys_new (key, expiration, user_id, duration, cooldown) "
+        "SELECT key, CASE WHEN expiration IS NULL OR expiration = '' THEN NULL "
+        "ELSE COALESCE(CAST(strftime('%s', expiration, 'utc') AS INTEGER), 0) END, user_id, duration, cooldown FROM keys"
+    )
+    await db.execute("DROP TABLE keys")
+    await db.execute("ALTER TABLE keys_new RENAME TO keys")
+    await db.execute("CREATE INDEX idx_keys_user_id ON keys (user_id)")
+    await db.execute("CREATE INDEX idx_keys_expiration ON keys (expiration)")
+    await db.execute("CREATE TABLE IF NOT EXISTS keys_archive (key TEXT PRIMARY KEY, expiration INTEGER, user_id INTEGER, duration TEXT NOT NULL, cooldown INTEGER NOT NULL, archived_at INTEGER NOT NULL)")
+
+async def _migration_bot_meta(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS bot_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+def account_hash(account: str) -> int:
+    """64-bit content hash of an account line, as a signed integer SQLite stores in 8 bytes."""
+    # At 64 bits a false duplicate needs billions of accounts on one platform
+    return int.from_bytes(hashlib.blake2b(account.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+async def _migration_account_hashes(db):
+    # Existing rows keep a NULL hash (NULLs never collide in a unique index) until
+    # dedupe_accounts backfills them in the background, dropping duplicates as it goes.
+    # The hash index replaces the much larger (platform, account) text index.
+    await db.execute("ALTER TABLE accounts ADD COLUMN account_hash INTEGER")
+    await db.execute("CREATE UNIQUE INDEX idx_accounts_platform_hash ON accounts (platform, account_hash)")
+    await db.execute("DROP INDEX IF EXISTS idx_accounts_platform_account")
+
+async def _migration_jobs(db):
+    # Background jobs live in the local SQLite file with the other bot metadata, whichever
+    # database holds the accounts and keys they work on
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+        "status TEXT NOT NULL, params TEXT NOT NULL, state TEXT NOT NULL DEFAULT '{}', "
+        "progress INTEGER NOT NULL DEFAULT 0, total INTEGER, created_by INTEGER NOT NULL, "
+        "channel_id INTEGER, message_id INTEGER, error TEXT, created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL)"
+    )
+    await db.execute("CREATE INDEX idx_jobs_status ON jobs (status)")
+
+async def _migration_event_journal(db):
+    # Append-only journal of key and dispense events. Rollups are kept incrementally by the
+    # same transaction that appends the events, so trend reads never scan the journal
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, at INTEGER NOT NULL, kind TEXT NOT NULL, "
+        "user_id INTEGER, platform TEXT, key TEXT, amount INTEGER)"
+    )
+    await db.execute("CREATE INDEX idx_events_at ON events (at)")
+    for action in ("UPDATE", "DELETE"):
+        await db.execute(
+            f"CREATE TRIGGER events_append_only_{action.lower()} BEFORE {action} ON events "
+            "BEGIN SELECT RAISE(ABORT, 'events are append-only'); END"
+        )
+    for table in ("event_rollups_hourly", "event_rollups_daily"):
+        await db.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER NOT NULL, kind TEXT NOT NULL, "
+            "platform TEXT NOT NULL DEFAULT '', events INTEGER NOT NULL, PRIMARY KEY (bucket, kind, platform)) WITHOUT ROWID"
+        )
+
+async def _migration_job_output(db):
+    # Minted and revoked keys lived in the jobs row and were rewritten at every checkpoint;
+    # they are appended to job_items instead, once each
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS job_items (job_id INTEGER NOT NULL, seq INTEGER NOT NULL, item TEXT NOT NULL, "
+        "PRIMARY KEY (job_id, seq)) WITHOUT ROWID"
+    )
+    await db.execute("CREATE INDEX idx_jobs_updated_at ON jobs (updated_at)")
+    await db.execute(
+        "INSERT INTO job_items (job_id, seq, item) "
+        "SELECT jobs.id, items.key, items.value FROM jobs, json_each(jobs.params, '$.keys') AS items"
+    )
+    await db.execute(
+        "INSERT INTO job_items (job_id, seq, item) "
+        "SELECT jobs.id, items.key, items.value FROM jobs, json_each(jobs.state, '$.revoked') AS items"
+    )
+    await db.execute("UPDATE jobs SET params = json_remove(params, '$.keys') WHERE json_type(params, '$.keys') IS NOT NULL")
+    await db.execute(
+        "UPDATE jobs SET state = json_set(json_remove(state, '$.revoked'), '$.shown', "
+        "(SELECT json_group_array(value) FROM (SELECT value FROM json_each(jobs.state, '$.revoked') ORDER BY key LIMIT ?))) "
+        "WHERE json_type(state, '$.revoked') IS NOT NULL",
+        (50,)  # RevokeUserJob.SHOWN_KEYS when this migration was written
+    )
+
+# Ordered schema migrations. Append new entries; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, "initial schema", _migration_initial_schema),
+    (2, "account leases", _migration_account_leases),
+    (3, "hot query indexes", _migration_hot_query_indexes),
+    (4, "platform inventory counters", _migration_platform_inventory),
+    (5, "account lookup index", _migration_account_lookup_index),
+    (6, "dispense cooldowns", _migration_dispense_cooldowns),
+    (7, "epoch key expiration and archive", _migration_epoch_key_expiration),
+    (8, "bot metadata", _migration_bot_meta),
+    (9, "account content hashes", _migration_account_hashes),
+    (10, "background jobs", _migration_jobs),
+    (11, "event journal", _migration_event_journal),
+    (12, "job output", _migration_job_output),
+]
+
 async def initialize_database():
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, platform TEXT NOT NULL, account TEXT NOT NULL)")
-        await db.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, expiration TEXT NOT NULL, user_id INTEGER, duration TEXT NOT NULL, cooldown INTEGER NOT NULL)")
-        await db.execute("CREATE TABLE IF NOT EXISTS generated_stats (user_id INTEGER PRIMARY KEY, generated_count INTEGER DEFAULT 0)")
-        await db.execute("CREATE TABLE IF NOT EXISTS admin_users (user_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS admin_roles (role_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS blacklisted_users (user_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS platforms (platform TEXT PRIMARY KEY)")
+    """Applies every migration newer than the recorded schema version, each in its own transaction."""
+    async with bot.db.write() as db:
+        await db.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL)")
         await db.commit()
+        async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+            current_version = (await cursor.fetchone())[0]
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current_version:
+                continue
+            await db.execute("BEGIN IMMEDIATE")
+            await migrate(db)
+            await db.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.datetime.now().isoformat())
+            )
+            await db.commit()
+            print(f"Applied database migration {version}: {description}")
 
-async def is_admin(interaction: Interaction) -> bool:
-    """Checks if the user is an admin based on recognized roles or user IDs."""
-    user_id = interaction.user.id
-    roles = [role.id for role in interaction.user.roles]
+# Repositories: the data access the commands use instead of raw SQL. Each store has an
+# aiosqlite implementation over DatabasePool and an asyncpg one over a Postgres pool.
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Check if the user is explicitly an admin
-        async with db.execute("SELECT 1 FROM admin_users WHERE user_id = ?", (user_id,)) as cursor:
-            if await cursor.fetchone():
-                return True
+class AccountStore:
+    """Platforms and account stock."""
 
-        # Check if the user has any recognized admin role
-        async with db.execute("SELECT role_id FROM admin_roles") as cursor:
-            recognized_roles = [row[0] for row in await cursor.fetchall()]
-            if any(role in recognized_roles for role in roles):
-                return True
+    async def platforms(self) -> list[str]:
+        raise NotImplementedError
 
-    return False
+    async def create_platform(self, platform: str) -> bool:
+        """Returns False when the platform already exists."""
+        raise NotImplementedError
 
-async def admin_only(interaction: Interaction):
-    """Restricts command access to admins."""
-    if not await is_admin(interaction):
-        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
-        raise Exception("Unauthorized access attempt.")
+    async def add_account(self, platform: str, account: str) -> bool:
+        """Returns False when the account is already stocked for the platform."""
+        raise NotImplementedError
+
+    async def add_new_accounts(self, platform: str, accounts: list[str]) -> int:
+        """Inserts the accounts not yet stocked for `platform`, in one transaction, skipping
+        duplicates by content hash. Returns how many were inserted."""
+        raise NotImplementedError
+
+    async def dedupe_batch(self, batch_size: int) -> tuple[int, int]:
+        """Hashes the next `batch_size` rows stored before content hashing, deleting any that
+        duplicate an older row. Returns (rows scanned, duplicates removed); (0, 0) once done."""
+        raise NotImplementedError
+
+    async def inventory(self) -> list[tuple[str, int]]:
+        """(platform, available) for every platform in stock, by name."""
+        raise NotImplementedError
+
+    async def dispense(self, platform: str) -> str | None:
+        """Removes and returns one unleased account, or None when out of stock."""
+        raise NotImplementedError
+
+    async def rebuild_inventory(self) -> dict[str, tuple[int, int]]:
+        """Recounts stock counters. Returns {platform: (counted, actual)} for any that drifted."""
+        raise NotImplementedError
+
+class KeyStore:
+    """Keys and their archive. Key rows are (key, expiration, cooldown, user_id), expiration in epoch seconds."""
+
+    async def insert(self, keys: list[str], expiration: int | None, duration: str, cooldown: int):
+        """Keys already stored are left alone, so a resumed job can replay its last batch."""
+        raise NotImplementedError
+
+    async def by_key(self, key: str) -> tuple | None:
+        raise NotImplementedError
+
+    async def by_user(self, user_id: int) -> tuple | None:
+        raise NotImplementedError
+
+    async def by_users(self, user_ids: list[int]) -> list[tuple]:
+        raise NotImplementedError
+
+    async def activate(self, key: str, user_id: int, now: int) -> tuple[bool, int | None]:
+        """Claims an unassigned, unexpired key in one guarded statement. Returns (activated, expiration)."""
+        raise NotImplementedError
+
+    async def is_archived(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def revoke(self, key: str) -> tuple[bool, int | None]:
+        """Deletes the key. Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def revoke_user_batch(self, user_id: int, limit: int) -> list[str]:
+        """Deletes up to `limit` of the user's keys in one transaction. Returns the revoked keys."""
+        raise NotImplementedError
+
+    async def set_cooldown(self, key: str, cooldown: int) -> tuple[bool, int | None]:
+        """Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def make_lifetime(self, key: str) -> tuple[bool, int | None]:
+        """Clears the expiration. Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def extend(self, key: str, seconds: int, now: int) -> tuple[bool, int | None, int | None]:
+        """Adds time to the current expiration, or to `now` for lifetime keys.
+        Returns (existed, new expiration, owner)."""
+        raise NotImplementedError
+
+    async def count(self, status: str, user_id: int | None, now: int) -> int:
+        raise NotImplementedError
+
+    async def page(self, status: str, user_id: int | None, now: int, after: str | None = None,
+                   before: str | None = None, limit: int = 10) -> list[tuple]:
+        """Keyset pagination ordered by key: the page after `after`, or the page before `before`."""
+        raise NotImplementedError
+
+    async def archive_expired(self, now: int, limit: int) -> list[tuple[str, int | None]]:
+        """Moves up to `limit` expired keys into the archive in one transaction. Returns (key, owner) pairs."""
+        raise NotImplementedError
+
+class AdminStore:
+    async def users(self) -> list[int]:
+        raise NotImplementedError
+
+    async def roles(self) -> list[int]:
+        raise NotImplementedError
+
+    async def add_user(self, user_id: int):
+        raise NotImplementedError
+
+    async def add_role(self, role_id: int):
+        raise NotImplementedError
+
+    async def add_blacklisted(self, user_id: int) -> bool:
+        """Returns False when the user was already blacklisted."""
+        raise NotImplementedError
+
+    async def remove_blacklisted(self, user_id: int) -> bool:
+        """Returns False when the user was not blacklisted."""
+        raise NotImplementedError
+
+class StatsStore:
+    """Per-user dispense bookkeeping: generated counts and persisted cooldown windows."""
+
+    async def generated_count(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    async def add_generated(self, increments: dict[int, int]):
+        """Adds each user's increment to their generated count, in one transaction."""
+        raise NotImplementedError
+
+    async def generated_page(self, after: int, limit: int) -> list[tuple[int, int]]:
+        """(user_id, generated_count) for the next `limit` users after `after`, by user id."""
+        raise NotImplementedError
+
+    async def load_cooldowns(self, now: float) -> list[tuple[int, float, int]]:
+        """(user_id, last_dispense, cooldown) for windows still open at `now`, oldest first."""
+        raise NotImplementedError
+
+    async def save_cooldowns(self, changed: list[tuple[int, float, int]], removed: list[int], now: float):
+        """Upserts changed windows, deletes removed ones and drops any that closed before `now`."""
+        raise NotImplementedError
+
+    async def append_events(self, events: list[tuple]):
+        """Appends (at, kind, user_id, platform, key, amount) events and adds them to the rollups, in one transaction."""
+        raise NotImplementedError
+
+    async def rollups(self, period: str, since: int) -> list[tuple[int, str, str, int]]:
+        """(bucket, kind, platform, events) from the "hourly" or "daily" rollup, for buckets from `since` on."""
+        raise NotImplementedError
+
+# Rollup table and bucket width, by period. Buckets are UTC-aligned epoch seconds
+EVENT_ROLLUPS = {"hourly": ("event_rollups_hourly", 3600), "daily": ("event_rollups_daily", 86400)}
+
+def rollup_events(events: list[tuple]) -> dict[str, Counter]:
+    """Counts events per (bucket, kind, platform) for each rollup period."""
+    rollups = {period: Counter() for period in EVENT_ROLLUPS}
+    for at, kind, _, platform, _, _ in events:
+        for period, (_, width) in EVENT_ROLLUPS.items():
+            rollups[period][(at - at % width, kind, platform or "")] += 1
+    return rollups
+
+class Stores:
+    """The four repositories, all backed by one database."""
+
+    def __init__(self, accounts: AccountStore, keys: KeyStore, admins: AdminStore, stats: StatsStore):
+        self.accounts = accounts
+        self.keys = keys
+        self.admins = admins
+        self.stats = stats
+
+    async def close(self):
+        pass
+
+def _key_filter(status: str, user_id: int | None, now: int) -> tuple[list[str], list]:
+    """WHERE conditions (with ? placeholders) selecting keys for keys_viewall."""
+    conditions, params = [], []
+    if status == "unassigned":
+        conditions.append("user_id IS NULL")
+    elif status == "expired":
+        conditions.append("expiration IS NOT NULL AND expiration < ?")
+        params.append(now)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    return conditions, params
+
+def _key_page_query(status: str, user_id: int | None, now: int, after: str | None, before: str | None,
+                    limit: int, collation: str = "") -> tuple[str, list]:
+    """`collation` (e.g. ' COLLATE "C"') applies to the keyset predicates and the ORDER BY alike,
+    so both compare keys the same way."""
+    conditions, params = _key_filter(status, user_id, now)
+    key = f"key{collation}"
+    if after is not None:
+        conditions.append(f"{key} > ?")
+        params.append(after)
+    elif before is not None:
+        conditions.append(f"{key} < ?")
+        params.append(before)
+    order = "DESC" if before is not None else "ASC"
+    sql = (
+        "SELECT key, expiration, cooldown, user_id FROM keys"
+        f"{' WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY {key} {order} LIMIT ?"
+    )
+    return sql, [*params, limit]
+
+class SqliteAccountStore(AccountStore):
+    def __init__(self, pool: DatabasePool):
+        self.pool = pool
+
+    async def platforms(self):
+        async with self.pool.read() as db:
+            async with db.execute("SELECT platform FROM platforms") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def create_platform(self, platform):
+        async with self.pool.write() as db:
+            async with db.execute("INSERT OR IGNORE INTO platforms (platform) VALUES (?)", (platform,)) as cursor:
+                created = cursor.rowcount > 0
+            # Commit either way: an unfinished transaction would stay open on the shared writer
+            await db.commit()
+        return created
+
+    async def add_account(self, platform, account):
+        async with self.pool.write() as db:
+            async with db.execute(
+                "INSERT OR IGNORE INTO accounts (platform, account, account_hash) VALUES (?, ?, ?)",
+                (platform, account, account_hash(account))
+            ) as cursor:
+                inserted = cursor.rowcount
+            await db.commit()
+        return inserted > 0
+
+    async def add_new_accounts(self, platform, accounts):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            inserted = await self.insert_new_accounts(db, platform, accounts)
+            await db.commit()
+        return inserted
+
+    @staticmethod
+    async def insert_new_accounts(db, platform: str, accounts: list[str]) -> int:
+        """add_new_accounts on a writer connection, inside a transaction the caller commits."""
+        # The unique (platform, account_hash) index rejects stocked and repeated lines alike
+        async with db.executemany(
+            "INSERT OR IGNORE INTO accounts (platform, account, account_hash) VALUES (?, ?, ?)",
+            ((platform, account, account_hash(account)) for account in accounts)
+        ) as cursor:
+            return cursor.rowcount
+
+    async def dedupe_batch(self, batch_size):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute("SELECT value FROM bot_meta WHERE key = 'account_dedupe_after'") as cursor:
+                row = await cursor.fetchone()
+            if row is not None and row[0] == "done":
+                await db.commit()
+                return 0, 0
+            after = int(row[0]) if row else 0
+            async with db.execute(
+                "SELECT id, account FROM accounts WHERE id > ? AND account_hash IS NULL ORDER BY id LIMIT ?",
+                (after, batch_size)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            # Rows are hashed oldest first, so the oldest copy keeps the hash and later
+            # copies, left NULL by OR IGNORE, are the duplicates
+            await db.executemany(
+                "UPDATE OR IGNORE accounts SET account_hash = ? WHERE id = ?",
+                ((account_hash(account), row_id) for row_id, account in rows)
+            )
+            removed = 0
+            if rows:
+                async with db.execute(
+                    "DELETE FROM accounts WHERE id BETWEEN ? AND ? AND account_hash IS NULL",
+                    (rows[0][0], rows[-1][0])
+                ) as cursor:
+                    removed = cursor.rowcount
+            await db.execute(
+                "INSERT INTO bot_meta (key, value) VALUES ('account_dedupe_after', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(rows[-1][0]) if rows else "done",)
+            )
+            await db.commit()
+        return len(rows), removed
+
+    async def inventory(self):
+        # Maintained by triggers on accounts, so this never scans the accounts table
+        async with self.pool.read() as db:
+            async with db.execute("SELECT platform, available FROM platform_inventory WHERE available > 0 ORDER BY platform") as cursor:
+                return await cursor.fetchall()
+
+    async def dispense(self, platform):
+        async with self.pool.write() as db:
+            return await dispense_account(db, platform)
+
+    async def rebuild_inventory(self):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            drift = await rebuild_platform_inventory(db)
+            await db.commit()
+        return drift
+
+class SqliteKeyStore(KeyStore):
+    def __init__(self, pool: DatabasePool):
+        self.pool = pool
+
+    async def _fetchone(self, sql: str, params=()):
+        async with self.pool.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def _write_returning(self, sql: str, params=(), many: bool = False):
+        async with self.pool.write() as db:
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall() if many else await cursor.fetchone()
+            await db.commit()
+        return rows
+
+    async def insert(self, keys, expiration, duration, cooldown):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                "INSERT OR IGNORE INTO keys (key, expiration, user_id, duration, cooldown) VALUES (?, ?, NULL, ?, ?)",
+                ((key, expiration, duration, cooldown) for key in keys)
+            )
+            await db.commit()
+
+    async def by_key(self, key):
+        return await self._fetchone("SELECT key, expiration, cooldown, user_id FROM keys WHERE key = ?", (key,))
+
+    async def by_user(self, user_id):
+        return await self._fetchone("SELECT key, expiration, cooldown, user_id FROM keys WHERE user_id = ?", (user_id,))
+
+    async def by_users(self, user_ids):
+        placeholders = ", ".join("?" * len(user_ids))
+        async with self.pool.read() as db:
+            async with db.execute(
+                f"SELECT key, expiration, cooldown, user_id FROM keys WHERE user_id IN ({placeholders})", user_ids
+            ) as cursor:
+                return await cursor.fetchall()
+
+    async def activate(self, key, user_id, now):
+        row = await self._write_returning(
+            "UPDATE keys SET user_id = ? WHERE key = ? AND user_id IS NULL AND (expiration IS NULL OR expiration > ?) "
+            "RETURNING expiration",
+            (user_id, key, now)
+        )
+        return (False, None) if row is None else (True, row[0])
+
+    async def is_archived(self, key):
+        return await self._fetchone("SELECT 1 FROM keys_archive WHERE key = ?", (key,)) is not None
+
+    async def revoke(self, key):
+        row = await self._write_returning("DELETE FROM keys WHERE key = ? RETURNING user_id", (key,))
+        return (False, None) if row is None else (True, row[0])
+
+    async def revoke_user_batch(self, user_id, limit):
+        rows = await self._write_returning(
+            "DELETE FROM keys WHERE key IN (SELECT key FROM keys WHERE user_id = ? LIMIT ?) RETURNING key",
+            (user_id, limit), many=True
+        )
+        return [row[0] for row in rows]
+
+    async def set_cooldown(self, key, cooldown):
+        row = await self._write_returning("UPDATE keys SET cooldown = ? WHERE key = ? RETURNING user_id", (cooldown, key))
+        return (False, None) if row is None else (True, row[0])
+
+    async def make_lifetime(self, key):
+        row = await self._write_returning("UPDATE keys SET expiration = NULL WHERE key = ? RETURNING user_id", (key,))
+        return (False, None) if row is None else (True, row[0])
+
+    async def extend(self, key, seconds, now):
+        row = await self._write_returning(
+            "UPDATE keys SET expiration = COALESCE(NULLIF(expiration, 0), ?) + ? WHERE key = ? RETURNING expiration, user_id",
+            (now, seconds, key)
+        )
+        return (False, None, None) if row is None else (True, *row)
+
+    async def count(self, status, user_id, now):
+        conditions, params = _key_filter(status, user_id, now)
+        row = await self._fetchone(f"SELECT COUNT(*) FROM keys{' WHERE ' + ' AND '.join(conditions) if conditions else ''}", params)
+        return row[0]
+
+    async def page(self, status, user_id, now, after=None, before=None, limit=10):
+        sql, params = _key_page_query(status, user_id, now, after, before, limit)
+        async with self.pool.read() as db:
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+        return rows[::-1] if before is not None else rows
+
+    async def archive_expired(self, now, limit):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                "DELETE FROM keys WHERE key IN "
+                "(SELECT key FROM keys WHERE expiration IS NOT NULL AND expiration <= ? LIMIT ?) "
+                "RETURNING key, expiration, user_id, duration, cooldown",
+                (now, limit)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.executemany(
+                "INSERT OR REPLACE INTO keys_archive (key, expiration, user_id, duration, cooldown, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((*row, now) for row in rows)
+            )
+            await db.commit()
+        return [(key, user_id) for key, _, user_id, _, _ in rows]
+
+class SqliteAdminStore(AdminStore):
+    def __init__(self, pool: DatabasePool):
+        self.pool = pool
+
+    async def _column(self, sql: str) -> list[int]:
+        async with self.pool.read() as db:
+            async with db.execute(sql) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def users(self):
+        return await self._column("SELECT user_id FROM admin_users")
+
+    async def roles(self):
+        return await self._column("SELECT role_id FROM admin_roles")
+
+    async def add_user(self, user_id):
+        async with self.pool.write() as db:
+            await db.execute("INSERT OR IGNORE INTO admin_users (user_id) VALUES (?)", (user_id,))
+            await db.commit()
+
+    async def add_role(self, role_id):
+        async with self.pool.write() as db:
+            await db.execute("INSERT OR IGNORE INTO admin_roles (role_id) VALUES (?)", (role_id,))
+            await db.commit()
+
+    async def _changed(self, sql: str, user_id: int) -> bool:
+        async with self.pool.write() as db:
+            async with db.execute(sql, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        return row is not None
+
+    async def add_blacklisted(self, user_id):
+        return await self._changed(
+            "INSERT INTO blacklisted_users (user_id) VALUES (?) ON CONFLICT DO NOTHING RETURNING user_id", user_id
+        )
+
+    async def remove_blacklisted(self, user_id):
+        return await self._changed("DELETE FROM blacklisted_users WHERE user_id = ? RETURNING user_id", user_id)
+
+class SqliteStatsStore(StatsStore):
+    def __init__(self, pool: DatabasePool):
+        self.pool = pool
+
+    async def generated_count(self, user_id):
+        async with self.pool.read() as db:
+            async with db.execute("SELECT generated_count FROM generated_stats WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else 0
+
+    async def add_generated(self, increments):
+        async with self.pool.write() as db:
+            await db.executemany(
+                "INSERT INTO generated_stats (user_id, generated_count) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET generated_count = generated_count + excluded.generated_count",
+                increments.items()
+            )
+            await db.commit()
+
+    async def generated_page(self, after, limit):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT user_id, generated_count FROM generated_stats WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after, limit)
+            ) as cursor:
+                return await cursor.fetchall()
+
+    async def load_cooldowns(self, now):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT user_id, last_dispense, cooldown FROM dispense_cooldowns "
+                "WHERE last_dispense + cooldown > ? ORDER BY last_dispense",
+                (now,)
+            ) as cursor:
+                return await cursor.fetchall()
+
+    async def save_cooldowns(self, changed, removed, now):
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany(
+                "INSERT INTO dispense_cooldowns (user_id, last_dispense, cooldown) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET last_dispense = excluded.last_dispense, cooldown = excluded.cooldown",
+                changed
+            )
+            await db.executemany("DELETE FROM dispense_cooldowns WHERE user_id = ?", ((user_id,) for user_id in removed))
+            await db.execute("DELETE FROM dispense_cooldowns WHERE last_dispense + cooldown <= ?", (now,))
+            await db.commit()
+
+    async def append_events(self, events):
+        rollups = rollup_events(events)
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.executemany("INSERT INTO events (at, kind, user_id, platform, key, amount) VALUES (?, ?, ?, ?, ?, ?)", events)
+            for period, counts in rollups.items():
+                await db.executemany(
+                    f"INSERT INTO {EVENT_ROLLUPS[period][0]} (bucket, kind, platform, events) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(bucket, kind, platform) DO UPDATE SET events = events + excluded.events",
+                    [(*group, count) for group, count in counts.items()]
+                )
+            await db.commit()
+
+    async def rollups(self, period, since):
+        async with self.pool.read() as db:
+            async with db.execute(
+                f"SELECT bucket, kind, platform, events FROM {EVENT_ROLLUPS[period][0]} WHERE bucket >= ? ORDER BY bucket",
+                (since,)
+            ) as cursor:
+                return await cursor.fetchall()
+
+def sqlite_stores(pool: DatabasePool) -> Stores:
+    return Stores(SqliteAccountStore(pool), SqliteKeyStore(pool), SqliteAdminStore(pool), SqliteStatsStore(pool))
+
+def _numbered(sql: str) -> str:
+    """Rewrites ? placeholders as asyncpg's $1, $2, ..."""
+    parts = sql.split("?")
+    return parts[0] + "".join(f"${index}{part}" for index, part in enumerate(parts[1:], start=1))
+
+POSTGRES_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS platforms (platform TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS accounts (id BIGSERIAL PRIMARY KEY, platform TEXT NOT NULL, account TEXT NOT NULL, "
+    "account_hash BIGINT NOT NULL, leased_at DOUBLE PRECISION)",
+    # Tables created before content hashing gain the column empty; dedupe_accounts backfills it,
+    # drops the duplicates and then sets it NOT NULL. The unique index can come first, since
+    # NULL hashes never conflict with each other
+    "ALTER TABLE accounts ADD COLUMN IF NOT EXISTS account_hash BIGINT",
+    "CREATE INDEX IF NOT EXISTS idx_accounts_unhashed ON accounts (id) WHERE account_hash IS NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_accounts_platform_hash ON accounts (platform, account_hash)",
+    "CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, expiration BIGINT, user_id BIGINT, duration TEXT NOT NULL, cooldown INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_keys_user_id ON keys (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_keys_expiration ON keys (expiration)",
+    # Serves keyset paging, which compares keys in byte order
+    'CREATE INDEX IF NOT EXISTS idx_keys_key_c ON keys (key COLLATE "C")',
+    "CREATE TABLE IF NOT EXISTS keys_archive (key TEXT PRIMARY KEY, expiration BIGINT, user_id BIGINT, duration TEXT NOT NULL, cooldown INTEGER NOT NULL, archived_at BIGINT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS admin_users (user_id BIGINT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS admin_roles (role_id BIGINT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS blacklisted_users (user_id BIGINT PRIMARY KEY)",
+    # Per-platform stock counters, as in SQLite. Statement-level triggers fold a whole batch
+    # insert into one counter update per platform; accounts never change platform
+    "CREATE TABLE IF NOT EXISTS platform_inventory (platform TEXT PRIMARY KEY, available BIGINT NOT NULL DEFAULT 0)",
+    "CREATE OR REPLACE FUNCTION accounts_inventory_insert() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "INSERT INTO platform_inventory (platform, available) SELECT platform, COUNT(*) FROM inserted GROUP BY platform "
+    "ON CONFLICT (platform) DO UPDATE SET available = platform_inventory.available + excluded.available; "
+    "RETURN NULL; END $$",
+    "CREATE OR REPLACE FUNCTION accounts_inventory_delete() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "UPDATE platform_inventory SET available = available - removed.count "
+    "FROM (SELECT platform, COUNT(*) AS count FROM deleted GROUP BY platform) AS removed "
+    "WHERE platform_inventory.platform = removed.platform; "
+    "RETURN NULL; END $$",
+    "DROP TRIGGER IF EXISTS trg_accounts_inventory_insert ON accounts",
+    "CREATE TRIGGER trg_accounts_inventory_insert AFTER INSERT ON accounts REFERENCING NEW TABLE AS inserted "
+    "FOR EACH STATEMENT EXECUTE FUNCTION accounts_inventory_insert()",
+    "DROP TRIGGER IF EXISTS trg_accounts_inventory_delete ON accounts",
+    "CREATE TRIGGER trg_accounts_inventory_delete AFTER DELETE ON accounts REFERENCING OLD TABLE AS deleted "
+    "FOR EACH STATEMENT EXECUTE FUNCTION accounts_inventory_delete()",
+    # Seeds the counters for a database created before they existed; a no-op once any are stored
+    "INSERT INTO platform_inventory (platform, available) SELECT platform, COUNT(*) FROM accounts "
+    "WHERE NOT EXISTS (SELECT 1 FROM platform_inventory) GROUP BY platform",
+    "CREATE TABLE IF NOT EXISTS generated_stats (user_id BIGINT PRIMARY KEY, generated_count BIGINT NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS dispense_cooldowns (user_id BIGINT PRIMARY KEY, last_dispense DOUBLE PRECISION NOT NULL, cooldown INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS events (id BIGSERIAL PRIMARY KEY, at BIGINT NOT NULL, kind TEXT NOT NULL, "
+    "user_id BIGINT, platform TEXT, key TEXT, amount BIGINT)",
+    "CREATE INDEX IF NOT EXISTS idx_events_at ON events (at)",
+    "CREATE TABLE IF NOT EXISTS event_rollups_hourly (bucket BIGINT NOT NULL, kind TEXT NOT NULL, "
+    "platform TEXT NOT NULL DEFAULT '', events BIGINT NOT NULL, PRIMARY KEY (bucket, kind, platform))",
+    "CREATE TABLE IF NOT EXISTS event_rollups_daily (bucket BIGINT NOT NULL, kind TEXT NOT NULL, "
+    "platform TEXT NOT NULL DEFAULT '', events BIGINT NOT NULL, PRIMARY KEY (bucket, kind, platform))",
+)
+
+class PostgresStore:
+    """Shared helpers for the asyncpg stores."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def _fetch(self, sql: str, *params) -> list[tuple]:
+        async with self.pool.acquire() as conn:
+            return [tuple(row) for row in await conn.fetch(_numbered(sql), *params)]
+
+    async def _fetchrow(self, sql: str, *params) -> tuple | None:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(_numbered(sql), *params)
+        return None if row is None else tuple(row)
+
+    async def _execute(self, sql: str, *params):
+        async with self.pool.acquire() as conn:
+            await conn.execute(_numbered(sql), *params)
+
+class PostgresAccountStore(PostgresStore, AccountStore):
+    # Out of stock is only reported after this many tries found every candidate row locked
+    DISPENSE_RETRIES = 5
+
+    async def platforms(self):
+        return [row[0] for row in await self._fetch("SELECT platform FROM platforms")]
+
+    async def create_platform(self, platform):
+        row = await self._fetchrow("INSERT INTO platforms (platform) VALUES (?) ON CONFLICT DO NOTHING RETURNING platform", platform)
+        return row is not None
+
+    async def add_account(self, platform, account):
+        row = await self._fetchrow(
+            "INSERT INTO accounts (platform, account, account_hash) VALUES (?, ?, ?) ON CONFLICT DO NOTHING RETURNING id",
+            platform, account, account_hash(account)
+        )
+        return row is not None
+
+    async def add_new_accounts(self, platform, accounts):
+        # One statement for the whole batch; RETURNING counts the rows the unique index let through
+        rows = await self._fetch(
+            "INSERT INTO accounts (platform, account, account_hash) "
+            "SELECT ?, account, account_hash FROM unnest(?::text[], ?::bigint[]) AS batch (account, account_hash) "
+            "ON CONFLICT DO NOTHING RETURNING id",
+            platform, accounts, [account_hash(account) for account in accounts]
+        )
+        return len(rows)
+
+    async def dedupe_batch(self, batch_size):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                nullable = await conn.fetchval(
+                    "SELECT is_nullable FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = 'accounts' AND column_name = 'account_hash'"
+                )
+                if nullable == "NO":
+                    return 0, 0
+                # Holds off inserts (and other dedupers) so no hash lands between the check and the update
+                await conn.execute("LOCK TABLE accounts IN SHARE ROW EXCLUSIVE MODE")
+                rows = await conn.fetch(
+                    "SELECT id, platform, account FROM accounts WHERE account_hash IS NULL ORDER BY id LIMIT $1",
+                    batch_size
+                )
+                if not rows:
+                    await conn.execute("ALTER TABLE accounts ALTER COLUMN account_hash SET NOT NULL")
+                    return 0, 0
+                # The oldest copy in the batch keeps the hash unless a hashed row already holds it;
+                # every row still unhashed afterwards is a duplicate
+                kept = {}
+                for row_id, platform, account in rows:
+                    kept.setdefault((platform, account_hash(account)), row_id)
+                await conn.execute(
+                    "UPDATE accounts SET account_hash = batch.account_hash "
+                    "FROM unnest($1::bigint[], $2::bigint[]) AS batch (id, account_hash) "
+                    "WHERE accounts.id = batch.id AND NOT EXISTS (SELECT 1 FROM accounts AS other "
+                    "WHERE other.platform = accounts.platform AND other.account_hash = batch.account_hash)",
+                    list(kept.values()), [hashed for _, hashed in kept]
+                )
+                removed = await conn.fetch(
+                    "DELETE FROM accounts WHERE id = ANY($1::bigint[]) AND account_hash IS NULL RETURNING id",
+                    [row[0] for row in rows]
+                )
+        return len(rows), len(removed)
+
+    async def inventory(self):
+        # Maintained by triggers on accounts, so this never scans the accounts table
+        return await self._fetch("SELECT platform, available FROM platform_inventory WHERE available > 0 ORDER BY platform")
+
+    async def dispense(self, platform):
+        for _ in range(self.DISPENSE_RETRIES):
+            # SKIP LOCKED lets concurrent dispensers each take a different row instead of queueing
+            row = await self._fetchrow(
+                "DELETE FROM accounts WHERE id = (SELECT id FROM accounts WHERE platform = ? AND leased_at IS NULL "
+                "LIMIT 1 FOR UPDATE SKIP LOCKED) RETURNING account",
+                platform
+            )
+            if row is not None:
+                return row[0]
+            # Nothing unlocked: either truly out of stock or every row is mid-dispense elsewhere
+            if await self._fetchrow("SELECT 1 FROM accounts WHERE platform = ? AND leased_at IS NULL LIMIT 1", platform) is None:
+                return None
+        return None
+
+    async def rebuild_inventory(self):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # Holds off account writes so the recount and the counters agree
+                await conn.execute("LOCK TABLE accounts IN SHARE MODE")
+                counted = dict(await conn.fetch("SELECT platform, available FROM platform_inventory"))
+                actual = dict(await conn.fetch("SELECT platform, COUNT(*) FROM accounts GROUP BY platform"))
+                drift = {
+                    platform: (counted.get(platform, 0), actual.get(platform, 0))
+                    for platform in counted.keys() | actual.keys()
+                    if counted.get(platform, 0) != actual.get(platform, 0)
+                }
+                await conn.execute("DELETE FROM platform_inventory")
+                await conn.executemany("INSERT INTO platform_inventory (platform, available) VALUES ($1, $2)", list(actual.items()))
+        return drift
+
+class PostgresKeyStore(PostgresStore, KeyStore):
+    async def insert(self, keys, expiration, duration, cooldown):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    "INSERT INTO keys (key, expiration, user_id, duration, cooldown) VALUES ($1, $2, NULL, $3, $4) "
+                    "ON CONFLICT DO NOTHING",
+                    [(key, expiration, duration, cooldown) for key in keys]
+                )
+
+    async def by_key(self, key):
+        return await self._fetchrow("SELECT key, expiration, cooldown, user_id FROM keys WHERE key = ?", key)
+
+    async def by_user(self, user_id):
+        return await self._fetchrow("SELECT key, expiration, cooldown, user_id FROM keys WHERE user_id = ? LIMIT 1", user_id)
+
+    async def by_users(self, user_ids):
+        return await self._fetch("SELECT key, expiration, cooldown, user_id FROM keys WHERE user_id = ANY(?::bigint[])", user_ids)
+
+    async def activate(self, key, user_id, now):
+        row = await self._fetchrow(
+            "UPDATE keys SET user_id = ? WHERE key = ? AND user_id IS NULL AND (expiration IS NULL OR expiration > ?) "
+            "RETURNING expiration",
+            user_id, key, now
+        )
+        return (False, None) if row is None else (True, row[0])
+
+    async def is_archived(self, key):
+        return await self._fetchrow("SELECT 1 FROM keys_archive WHERE key = ?", key) is not None
+
+    async def revoke(self, key):
+        row = await self._fetchrow("DELETE FROM keys WHERE key = ? RETURNING user_id", key)
+        return (False, None) if row is None else (True, row[0])
+
+    async def revoke_user_batch(self, user_id, limit):
+        rows = await self._fetch(
+            "DELETE FROM keys WHERE key IN (SELECT key FROM keys WHERE user_id = ? LIMIT ?) RETURNING key", user_id, limit
+        )
+        return [row[0] for row in rows]
+
+    async def set_cooldown(self, key, cooldown):
+        row = await self._fetchrow("UPDATE keys SET cooldown = ? WHERE key = ? RETURNING user_id", cooldown, key)
+        return (False, None) if row is None else (True, row[0])
+
+    async def make_lifetime(self, key):
+        row = await self._fetchrow("UPDATE keys SET expiration = NULL WHERE key = ? RETURNING user_id", key)
+        return (False, None) if row is None else (True, row[0])
+
+    async def extend(self, key, seconds, now):
+        row = await self._fetchrow(
+            "UPDATE keys SET expiration = COALESCE(NULLIF(expiration, 0), ?) + ? WHERE key = ? RETURNING expiration, user_id",
+            now, seconds, key
+        )
+        return (False, None, None) if row is None else (True, *row)
+
+    async def count(self, status, user_id, now):
+        conditions, params = _key_filter(status, user_id, now)
+        row = await self._fetchrow(f"SELECT COUNT(*) FROM keys{' WHERE ' + ' AND '.join(conditions) if conditions else ''}", *params)
+        return row[0]
+
+    async def page(self, status, user_id, now, after=None, before=None, limit=10):
+        # COLLATE "C" matches SQLite's byte-order comparison of keys, whatever the database's collation
+        sql, params = _key_page_query(status, user_id, now, after, before, limit, collation=' COLLATE "C"')
+        rows = await self._fetch(sql, *params)
+        return rows[::-1] if before is not None else rows
+
+    async def archive_expired(self, now, limit):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    "WITH moved AS (DELETE FROM keys WHERE key IN "
+                    "(SELECT key FROM keys WHERE expiration IS NOT NULL AND expiration <= $1 LIMIT $2 FOR UPDATE SKIP LOCKED) "
+                    "RETURNING key, expiration, user_id, duration, cooldown) "
+                    "INSERT INTO keys_archive (key, expiration, user_id, duration, cooldown, archived_at) "
+                    "SELECT key, expiration, user_id, duration, cooldown, $1 FROM moved "
+                    "ON CONFLICT (key) DO UPDATE SET expiration = excluded.expiration, user_id = excluded.user_id, "
+                    "duration = excluded.duration, cooldown = excluded.cooldown, archived_at = excluded.archived_at "
+                    "RETURNING key, user_id",
+                    now, limit
+                )
+        return [tuple(row) for row in rows]
+
+class PostgresAdminStore(PostgresStore, AdminStore):
+    async def users(self):
+        return [row[0] for row in await self._fetch("SELECT user_id FROM admin_users")]
+
+    async def roles(self):
+        return [row[0] for row in await self._fetch("SELECT role_id FROM admin_roles")]
+
+    async def add_user(self, user_id):
+        await self._execute("INSERT INTO admin_users (user_id) VALUES (?) ON CONFLICT DO NOTHING", user_id)
+
+    async def add_role(self, role_id):
+        await self._execute("INSERT INTO admin_roles (role_id) VALUES (?) ON CONFLICT DO NOTHING", role_id)
+
+    async def add_blacklisted(self, user_id):
+        row = await self._fetchrow(
+            "INSERT INTO blacklisted_users (user_id) VALUES (?) ON CONFLICT DO NOTHING RETURNING user_id", user_id
+        )
+        return row is not None
+
+    async def remove_blacklisted(self, user_id):
+        return await self._fetchrow("DELETE FROM blacklisted_users WHERE user_id = ? RETURNING user_id", user_id) is not None
+
+class PostgresStatsStore(PostgresStore, StatsStore):
+    async def generated_count(self, user_id):
+        row = await self._fetchrow("SELECT generated_count FROM generated_stats WHERE user_id = ?", user_id)
+        return row[0] if row else 0
+
+    async def add_generated(self, increments):
+        async with self.pool.acquire() as conn:
+            await conn.executemany(
+                "INSERT INTO generated_stats (user_id, generated_count) VALUES ($1, $2) "
+                "ON CONFLICT (user_id) DO UPDATE SET generated_count = generated_stats.generated_count + excluded.generated_count",
+                list(increments.items())
+            )
+
+    async def generated_page(self, after, limit):
+        return await self._fetch(
+            "SELECT user_id, generated_count FROM generated_stats WHERE user_id > ? ORDER BY user_id LIMIT ?", after, limit
+        )
+
+    async def load_cooldowns(self, now):
+        return await self._fetch(
+            "SELECT user_id, last_dispense, cooldown FROM dispense_cooldowns "
+            "WHERE last_dispense + cooldown > ? ORDER BY last_dispense",
+            now
+        )
+
+    async def save_cooldowns(self, changed, removed, now):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    "INSERT INTO dispense_cooldowns (user_id, last_dispense, cooldown) VALUES ($1, $2, $3) "
+                    "ON CONFLICT (user_id) DO UPDATE SET last_dispense = excluded.last_dispense, cooldown = excluded.cooldown",
+                    changed
+                )
+                await conn.execute("DELETE FROM dispense_cooldowns WHERE user_id = ANY($1::bigint[])", list(removed))
+                await conn.execute("DELETE FROM dispense_cooldowns WHERE last_dispense + cooldown <= $1", now)
+
+    async def append_events(self, events):
+        rollups = rollup_events(events)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    "INSERT INTO events (at, kind, user_id, platform, key, amount) VALUES ($1, $2, $3, $4, $5, $6)", events
+                )
+                for period, counts in rollups.items():
+                    table = EVENT_ROLLUPS[period][0]
+                    await conn.executemany(
+                        f"INSERT INTO {table} (bucket, kind, platform, events) VALUES ($1, $2, $3, $4) "
+                        f"ON CONFLICT (bucket, kind, platform) DO UPDATE SET events = {table}.events + excluded.events",
+                        [(*group, count) for group, count in counts.items()]
+                    )
+
+    async def rollups(self, period, since):
+        return await self._fetch(
+            f"SELECT bucket, kind, platform, events FROM {EVENT_ROLLUPS[period][0]} WHERE bucket >= ? ORDER BY bucket", since
+        )
+
+class PostgresStores(Stores):
+    def __init__(self, pool):
+        super().__init__(PostgresAccountStore(pool), PostgresKeyStore(pool), PostgresAdminStore(pool), PostgresStatsStore(pool))
+        self.pool = pool
+
+    async def close(self):
+        await self.pool.close()
+
+async def connect_postgres(dsn: str, max_size: int = POSTGRES_POOL_SIZE) -> PostgresStores:
+    """Opens an asyncpg pool and creates the schema if needed. Requires the optional asyncpg package."""
+    if asyncpg is None:
+        raise RuntimeError("DATABASE_URL points at Postgres but asyncpg is not installed (pip install asyncpg)")
+    pool = await asyncpg.create_pool(dsn, min_size=1, max_size=max_size)
+    async with pool.acquire() as conn:
+        # Serialize schema creation between processes starting at the same time
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('bot_schema'))")
+            for statement in POSTGRES_SCHEMA:
+                await conn.execute(statement)
+    return PostgresStores(pool)
+
+async def open_stores(pool: DatabasePool) -> Stores:
+    """Postgres when DATABASE_URL is set, otherwise the SQLite database behind `pool`."""
+    if DATABASE_URL:
+        return await connect_postgres(DATABASE_URL)
+    return sqlite_stores(pool)
+
+class AdminCache:
+    """
+    In-process copy of admin_users and admin_roles, so authorization never touches SQLite.
+    Loaded once at startup and updated by the storage backend as admins are added; with
+    shard processes the coordinator pushes each addition to every shard.
+    """
+
+    def __init__(self):
+        self.users: frozenset[int] = frozenset()
+        self.roles: frozenset[int] = frozenset()
+
+    async def load(self, store: AdminStore):
+        users = frozenset(await store.users())
+        roles = frozenset(await store.roles())
+        self.users, self.roles = users, roles
+
+    def add_user(self, user_id: int):
+        self.users = self.users | {user_id}
+
+    def add_role(self, role_id: int):
+        self.roles = self.roles | {role_id}
+
+    def allows(self, user) -> bool:
+        if user.id in self.users:
+            return True
+        # Users outside a guild (DMs) have no roles
+        return any(role.id in self.roles for role in getattr(user, "roles", ()))
+
+admin_cache = AdminCache()
+
+def is_admin(interaction: Interaction) -> bool:
+    """Checks if the user is an admin based on recognized roles or user IDs."""
+    return admin_cache.allows(interaction.user)
+
+def admin_check():
+    """App command check restricting a command to admins."""
+    return app_commands.check(is_admin)
+
+@bot.tree.error
+async def on_app_command_error(interaction: Interaction, error: app_commands.AppCommandError):
+    if isinstance(error, app_commands.CheckFailure):
+        message = "You do not have permission to use this command."
+    else:
+        command_name = interaction.command.name if interaction.command else "unknown"
+        print(f"Error in command {command_name}:")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        message = "Something went wrong while running this command."
+    try:
+        if interaction.response.is_done():
+            # Scheduled commands are deferred before their body runs, so only a followup reaches the user
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
+    except discord.HTTPException as e:
+        print(f"Could not report the error to the user: {e}")
 
 @bot.event
 async def on_ready():
-    await initialize_database()
+    # Fires again after every gateway reconnect; one-time setup lives in MyBot.setup_hook
+    if not bot.startup.reported:
+        bot.startup.mark("gateway ready")
+        bot.startup.reported = True
+        print(bot.startup.report())
     print(f"Logged in as {bot.user}")
     activity = discord.Streaming(name="Coded By Clapps", url="https://beziic.wtf")
     await bot.change_presence(status=discord.Status.dnd, activity=activity)
 
 @bot.tree.command(name="platform-create", description="Create a new platform (Admin only).")
 @app_commands.describe(platform="Name of the platform to add.")
+@admin_check()
 async def platform_create(interaction: Interaction, platform: str):
-    await admin_only(interaction)
     if not interaction.user.guild_permissions.administrator:
         embed = discord.Embed(description="You don't have permission to use this command.", color=discord.Color.red())
         await interaction.response.send_message(embed=embed, ephemeral=True)
         return
-    async with aiosqlite.connect(DB_FILE) as db:
-        try:
-            await db.execute("INSERT INTO platforms (platform) VALUES (?)", (platform,))
-            await db.commit()
-            embed = discord.Embed(description=f"Platform `{platform}` has been added successfully.", color=discord.Color.green())
-            await interaction.response.send_message(embed=embed)
-        except aiosqlite.IntegrityError:
-            embed = discord.Embed(description=f"Platform `{platform}` already exists.", color=discord.Color.red())
-            await interaction.response.send_message(embed=embed, ephemeral=True)
-
-class PlatformSelect(Select):
-    def __init__(self, platforms, callback):
-        options = [
-            discord.SelectOption(label=platform, value=platform) for platform in platforms
-        ]
-        super().__init__(placeholder="Select a platform...", options=options, custom_id="platform_select")
-        self.callback = callback
+    if await bot.stores.accounts.create_platform(platform):
+        embed = discord.Embed(description=f"Platform `{platform}` has been added successfully.", color=discord.Color.green())
+        await interaction.response.send_message(embed=embed)
+    else:
+        embed = discord.Embed(description=f"Platform `{platform}` already exists.", color=discord.Color.red())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+INGEST_CHUNK_SIZE = 64 * 1024
+INGEST_BATCH_SIZE = 5000
+
+async def attachment_chunks(url: str, chunk_size: int = INGEST_CHUNK_SIZE):
+    """Streams an attachment's bytes from the CDN without holding the whole file in memory."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+async def decode_lines(chunks):
+    """Incrementally decodes UTF-8 byte chunks into stripped lines."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.strip()
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.strip()
+
+def is_valid_account(line: str) -> bool:
+    """Accepts `user:pass` lines with a non-empty user and password."""
+    user, separator, password = line.partition(":")
+    return bool(separator and user and password) and "\ufffd" not in line
+
+class IngestReport:
+    COUNTS = ("added", "blank", "invalid", "duplicates")
+
+    def __init__(self, platform: str):
+        self.platform = platform
+        self.added = 0
+        self.blank = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.started = time.perf_counter()
+
+    @property
+    def lines(self) -> int:
+        """Lines consumed so far; at a batch boundary, every one of them is stored or skipped."""
+        return self.added + self.blank + self.invalid + self.duplicates
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.added / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Added **{self.added}** accounts to {self.platform} "
+            f"({self.rows_per_second:,.0f} rows/sec).\n"
+            f"Skipped {self.duplicates} duplicate, {self.invalid} invalid and {self.blank} blank lines."
+        )
+
+async def _insert_account_batch(store: AccountStore, platform: str, batch: list[str], report: IngestReport):
+    # dict.fromkeys dedupes within the batch while keeping file order
+    added = await store.add_new_accounts(platform, list(dict.fromkeys(batch)))
+    report.added += added
+    report.duplicates += len(batch) - added
+
+async def ingest_accounts(store: AccountStore, platform: str, lines, batch_size: int = INGEST_BATCH_SIZE,
+                          on_progress=None, report: IngestReport | None = None, stock=None) -> IngestReport:
+    """
+    Validates, dedupes and inserts streamed account lines in bounded batches.
+    Each batch is its own transaction, so the write lock is released between batches.
+    Lines repeated within the file or already stocked for `platform` are skipped.
+    Pass the `report` of an interrupted import to keep counting from where it stopped.
+    `stock(batch, report)` replaces the insert of each batch, counting it into `report`.
+    """
+    if report is None:
+        report = IngestReport(platform)
+    if stock is None:
+        stock = functools.partial(_insert_account_batch, store, platform)
+    batch = []
+    async for line in lines:
+        if not line:
+            report.blank += 1
+        elif not is_valid_account(line):
+            report.invalid += 1
+        else:
+            batch.append(line)
+            if len(batch) >= batch_size:
+                await stock(batch, report)
+                batch = []
+                if on_progress is not None:
+                    await on_progress(report)
+    if batch:
+        await stock(batch, report)
+    return report
+
+ACCOUNT_DEDUPE_BATCH_SIZE = 2000
+
+async def dedupe_accounts(store: AccountStore, batch_size: int = ACCOUNT_DEDUPE_BATCH_SIZE) -> int:
+    """
+    Backfills content hashes for accounts stocked before migration 9, removing duplicates.
+    Each batch is one short transaction and progress is saved with it, so dispenses interleave
+    with the backfill and a restart resumes where it stopped. Returns how many rows were removed.
+    """
+    start = time.perf_counter()
+    scanned = removed = 0
+    while True:
+        batch_scanned, batch_removed = await store.dedupe_batch(batch_size)
+        if not batch_scanned:
+            break
+        scanned += batch_scanned
+        removed += batch_removed
+        # Let queued commands take the write lock before the next batch
+        await asyncio.sleep(0)
+    if scanned:
+        print(f"Account dedupe hashed {scanned} row(s) and removed {removed} duplicate(s) "
+              f"in {time.perf_counter() - start:.1f}s.")
+    return removed
+
+class PendingUploads:
+    """
+    Attachments waiting for their /bulk_add platform choice, keyed by the short token in the
+    select's custom_id. Bounded and expiring; after a restart the select asks for a re-upload,
+    since attachment URLs are signed and too long to fit in a custom_id.
+    """
 
-class PlatformView(View):
-    def __init__(self, platforms, callback):
-        super().__init__()
-        self.add_item(PlatformSelect(platforms, callback))
+    def __init__(self, ttl: float = 900.0, max_entries: int = 200, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._uploads: OrderedDict[str, tuple[float, discord.Attachment]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._uploads)
+
+    def add(self, attachment: discord.Attachment) -> str:
+        token = secrets.token_hex(8)
+        self._uploads[token] = (self.clock(), attachment)
+        while len(self._uploads) > self.max_entries:
+            self._uploads.popitem(last=False)
+        return token
+
+    def pop(self, token: str) -> discord.Attachment | None:
+        entry = self._uploads.pop(token, None)
+        if entry is None or self.clock() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+pending_uploads = PendingUploads()
+
+class BulkAddPlatformSelect(discord.ui.DynamicItem[Select], template=r"bulk_add:(?P<token>[0-9a-f]+)"):
+    """Platform choice for a pending /bulk_add upload."""
+
+    def __init__(self, token: str, options=()):
+        super().__init__(Select(placeholder="Select a platform...", options=list(options), custom_id=f"bulk_add:{token}"))
+        self.token = token
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Select, match: re.Match):
+        return cls(match["token"], item.options)
+
+    async def callback(self, interaction: Interaction):
+        file = pending_uploads.pop(self.token)
+        if file is None:
+            embed = discord.Embed(description="This upload has expired. Please run /bulk_add again.", color=discord.Color.red())
+            await interaction.response.edit_message(embed=embed, view=None)
+            return
+        # The upload flow is ephemeral, so progress goes to the admin's DMs: a real message the
+        # runner can still edit after a restart, unlike an ephemeral followup
+        dm = await interaction.user.create_dm()
+        job = await submit_job(
+            "bulk_add", {"url": file.url, "filename": file.filename, "platform": self.item.values[0]},
+            interaction.user.id, dm, fallback=interaction.channel
+        )
+        where = "sent to you by direct message" if job.channel_id == dm.id else "posted in this channel"
+        embed = discord.Embed(
+            description=f"Queued as job #{job.id}. Progress is {where}; "
+                        f"cancel it with `/jobs cancel:{job.id}`.",
+            color=discord.Color.blue()
+        )
+        await interaction.response.edit_message(embed=embed, view=None)
 
 @bot.tree.command(name="bulk_add", description="Adds multiple accounts from an uploaded .txt file.")
 @app_commands.describe(file="Text file containing accounts, one per line.")
+@admin_check()
 async def bulk_add(interaction: Interaction, file: discord.Attachment):
-    await admin_only(interaction)
     if not file.filename.endswith('.txt'):
         embed = discord.Embed(description="Invalid file type. Please upload a .txt file.", color=discord.Color.red())
         await interaction.response.send_message(embed=embed, ephemeral=True)
         return
 
-    try:
-        file_content = await file.read()
-        accounts_list = file_content.decode('utf-8').splitlines()
-    except Exception as e:
-        embed = discord.Embed(description="Failed to read the file. Please try again.", color=discord.Color.red())
+    platforms = await bot.stores.accounts.platforms()
+    if not platforms:
+        embed = discord.Embed(description="No platforms available. Please add platforms first.", color=discord.Color.red())
         await interaction.response.send_message(embed=embed, ephemeral=True)
-        print(f"Error reading file: {e}")
         return
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT platform FROM platforms") as cursor:
-            platforms = [row[0] for row in await cursor.fetchall()]
-            if not platforms:
-                embed = discord.Embed(description="No platforms available. Please add platforms first.", color=discord.Color.red())
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-                return
-
-    async def handle_selection(interaction: Interaction):
-        selected_platform = interaction.data['values'][0]
-        async with aiosqlite.connect(DB_FILE) as db:
-            await db.executemany(
-                "INSERT INTO accounts (platform, account) VALUES (?, ?)",
-                [(selected_platform, account) for account in accounts_list]
-            )
-            await db.commit()
-
-        embed = discord.Embed(description=f"Added {len(accounts_list)} accounts to {selected_platform}.", color=discord.Color.green())
-        await interaction.response.edit_message(embed=embed, view=None)
-
-    view = PlatformView(platforms, handle_selection)
+    options = [discord.SelectOption(label=platform, value=platform) for platform in platforms]
+    view = View(timeout=None)
+    view.add_item(BulkAddPlatformSelect(pending_uploads.add(file), options))
     embed = discord.Embed(description="Please select the platform to add accounts.", color=discord.Color.blue())
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
 @bot.tree.command(name="add_account", description="Adds a single account to the generator.")
 @app_commands.describe(platform="Platform name", account="Account in user:pass format.")
+@admin_check()
 async def add_account(interaction: Interaction, platform: str, account: str):
-    await admin_only(interaction)
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT INTO accounts (platform, account) VALUES (?, ?)", (platform, account))
-        await db.commit()
+    if not await bot.stores.accounts.add_account(platform, account):
+        embed = discord.Embed(description=f"That account is already stocked for {platform}.", color=discord.Color.red())
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
     embed = discord.Embed(description=f"Account added to {platform}: {account}", color=discord.Color.green())
     await interaction.response.send_message(embed=embed)
 
+TREND_TOP_PLATFORMS = 3
+
+async def dispense_trends(store: StatsStore, now: int) -> str:
+    """Dispense trend lines for /stats: the last 24 hours against the 24 before, and the last 7 days."""
+    hour = now - now % 3600
+    day = now - now % 86400
+    recent, previous, platforms = 0, 0, Counter()
+    for bucket, kind, platform, events in await store.rollups("hourly", hour - 47 * 3600):
+        if kind != "dispense":
+            continue
+        if bucket > hour - 24 * 3600:
+            recent += events
+            platforms[platform] += events
+        else:
+            previous += events
+    daily = Counter()
+    for bucket, kind, _, events in await store.rollups("daily", day - 6 * 86400):
+        if kind == "dispense":
+            daily[bucket] += events
+
+    change = recent - previous
+    arrow = "▲" if change > 0 else "▼" if change < 0 else "▬"
+    top = ", ".join(f"{platform} ({events})" for platform, events in platforms.most_common(TREND_TOP_PLATFORMS))
+    week = " · ".join(str(daily[day - offset * 86400]) for offset in range(6, -1, -1))
+    return (
+        f"🔹 Last 24 Hours: **{recent}** ({arrow} {abs(change)} vs the previous 24 hours)\n"
+        f"🔹 Top Platforms (24h): {top or 'none yet'}\n"
+        f"🔹 Last 7 Days: {week}"
+    )
+
 @bot.tree.command(name="stats", description="View generator statistics.")
 async def stats(interaction: Interaction):
     user_id = interaction.user.id
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Get the total number of accounts in the generator
-        async with db.execute("SELECT COUNT(*) FROM accounts") as cursor:
-            total_accounts = await cursor.fetchone()
-            total_accounts = total_accounts[0] if total_accounts else 0
-
-        # Get the number of accounts generated by the user
-        async with db.execute("SELECT generated_count FROM generated_stats WHERE user_id = ?", (user_id,)) as cursor:
-            user_generated_count = await cursor.fetchone()
-            user_generated_count = user_generated_count[0] if user_generated_count else 0
-        # Fetch number of accounts per platform
-        async with db.execute("SELECT platform, COUNT(*) FROM accounts GROUP BY platform") as cursor:
-            platform_stats = await cursor.fetchall()
-
-        # Format platform stats for display
-        platform_stats_message = "\n".join(
-            [f"🔹 {platform}: {count}" for platform, count in platform_stats]
-        ) if platform_stats else "No accounts available on any platform."
+    # Get the number of accounts generated by the user, including unflushed dispenses
+    user_generated_count = await bot.storage.generated_count(user_id)
+
+    # Fetch number of accounts per platform
+    platform_stats = await bot.stores.accounts.inventory()
+
+    # Get the total number of accounts in the generator
+    total_accounts = sum(count for _, count in platform_stats)
+
+    # Format platform stats for display
+    platform_stats_message = "\n".join(
+        [f"🔹 {platform}: {count}" for platform, count in platform_stats]
+    ) if platform_stats else "No accounts available on any platform."
+
+    # Trends come from the rollups, a few seconds behind the journal buffer
+    trends_message = await dispense_trends(bot.stores.stats, int(time.time()))
 
     # Create the stats message
     stats_message = (
@@ -183,11 +2139,59 @@ async def stats(interaction: Interaction):
         f"🔹 Total Accounts in Generator: **{total_accounts}**\n"
         f"🔹 Accounts Generated by You: **{user_generated_count}**\n\n"
         f"**Accounts by Platform:**\n{platform_stats_message}\n\n"
+        f"**Dispense Trends:**\n{trends_message}\n\n"
         f"Thank you for using this generator! 😊"
     )
 
     await interaction.response.send_message(stats_message, ephemeral=True)
 
+@bot.tree.command(name="dispense_stats", description="View prefetch dispenser metrics (Admin only).")
+@admin_check()
+async def dispense_stats(interaction: Interaction):
+    if bot.dispenser is None:
+        await interaction.response.send_message("The prefetching dispenser is disabled.", ephemeral=True)
+        return
+
+    metrics = bot.dispenser.metrics()
+    depth_message = "\n".join(
+        [f"🔹 {platform}: {depth}" for platform, depth in metrics["queue_depth"].items()]
+    ) or "No platforms prefetched yet."
+    embed = discord.Embed(title="📦 Dispenser Metrics", color=discord.Color.blue())
+    embed.add_field(name="Hit Rate", value=f"{metrics['hit_rate']:.1%} ({metrics['hits']} hits / {metrics['misses']} misses)", inline=False)
+    embed.add_field(name="Refills", value=f"{metrics['refills']} (avg {metrics['refill_avg_ms']:.1f}ms, max {metrics['refill_max_ms']:.1f}ms)", inline=False)
+    embed.add_field(name="Delete Transactions", value=str(metrics["flushes"]), inline=False)
+    embed.add_field(name="Queue Depth", value=depth_message, inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="cache_stats", description="View key-status cache metrics (Admin only).")
+@admin_check()
+async def cache_stats(interaction: Interaction):
+    metrics = key_cache.metrics()
+    embed = discord.Embed(title="🗂️ Key Cache Metrics", color=discord.Color.blue())
+    embed.add_field(name="Hit Rate", value=f"{metrics['hit_rate']:.1%} ({metrics['hits']} hits / {metrics['misses']} misses)", inline=False)
+    embed.add_field(name="Cached Users", value=str(metrics["users"]), inline=True)
+    embed.add_field(name="Cached Keys", value=str(metrics["keys"]), inline=True)
+    embed.add_field(name="Users On Cooldown", value=str(len(cooldown_tracker)), inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="inventory_check", description="Rebuild the per-platform stock counters from the accounts table (Admin only).")
+@admin_check()
+async def inventory_check(interaction: Interaction):
+    drift = await bot.stores.accounts.rebuild_inventory()
+
+    if not drift:
+        embed = discord.Embed(description="Inventory counters are consistent.", color=discord.Color.green())
+    else:
+        drift_message = "\n".join(
+            [f"🔹 {platform}: {counted} → {actual}" for platform, (counted, actual) in sorted(drift.items())]
+        )
+        embed = discord.Embed(
+            title="Inventory counters rebuilt",
+            description=f"Corrected {len(drift)} platform(s):\n{drift_message}"[:4096],
+            color=discord.Color.orange()
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 def parse_duration(duration: str) -> timedelta | None:
     """
     Parses a duration string into a timedelta object. Returns None for 'lifetime'.
@@ -221,8 +2225,24 @@ def parse_duration(duration: str) -> timedelta | None:
     total_days = years * 365 + months * 30 + weeks * 7 + days
     return timedelta(days=total_days, hours=hours, minutes=minutes)
 
+KEY_PREFIX = "BEZIICPREM-"
+KEY_RANDOM_BYTES = 10  # 80 bits, which base32-encodes to exactly 16 characters
+MAX_BULK_KEYS = 100_000
 
-class DurationDropdown(Select):
+def mint_keys(count: int) -> list[str]:
+    """
+    Generates `count` distinct keys from a single secrets.token_bytes call.
+    Base32 maps every 5 bits to one character, so the keys carry no modulo bias.
+    """
+    keys = set()
+    while len(keys) < count:
+        missing = count - len(keys)
+        encoded = base64.b32encode(secrets.token_bytes(missing * KEY_RANDOM_BYTES)).decode("ascii")
+        width = KEY_RANDOM_BYTES * 8 // 5
+        keys.update(KEY_PREFIX + encoded[i:i + width] for i in range(0, len(encoded), width))
+    return list(keys)
+
+class DurationDropdown(discord.ui.DynamicItem[Select], template=r"duration_dropdown"):
     def __init__(self):
         options = [
             discord.SelectOption(label="1 Hour", value="1h"),
@@ -232,14 +2252,18 @@ class DurationDropdown(Select):
             discord.SelectOption(label="1 Year", value="1y"),
             discord.SelectOption(label="Lifetime", value="lifetime"),
         ]
-        super().__init__(
+        super().__init__(Select(
             placeholder="Select a duration",
             options=options,
             custom_id="duration_dropdown"
-        )
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Select, match: re.Match):
+        return cls()
 
     async def callback(self, interaction: discord.Interaction):
-        selected_duration = self.values[0]
+        selected_duration = self.item.values[0]
         # Open cooldown input modal after duration is selected
         await interaction.response.send_modal(CooldownInputModal(selected_duration))
 
@@ -254,310 +2278,1458 @@ class CooldownInputModal(Modal):
         )
         self.add_item(self.cooldown_input)
 
-    async def on_submit(self, interaction: discord.Interaction):
-        cooldown = int(self.cooldown_input.value)
+    async def on_submit(self, interaction: discord.Interaction):
+        cooldown = int(self.cooldown_input.value)
+        try:
+            expiration_timedelta = parse_duration(self.duration)
+            if expiration_timedelta is None:  # 'lifetime' case
+                expiration = None
+            else:
+                expiration = datetime.datetime.now() + expiration_timedelta
+        except ValueError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+
+        # Generate a key starting with BEZIICPREM-
+        key = mint_keys(1)[0]
+
+        await bot.storage.insert_keys([key], expiration, self.duration, cooldown)
+
+        expiration_message = "Lifetime" if expiration is None else f"Expires in: {expiration_timedelta}"
+        embed = discord.Embed(
+            description=(
+                f"Generated key: `{key}`\n"
+                f"{expiration_message}\n"
+                f"Cooldown: {cooldown} seconds"
+            ),
+            color=discord.Color.green()
+        )
+        await interaction.response.send_message(embed=embed)
+
+class GenerateKeyView(View):
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.add_item(DurationDropdown())
+
+@bot.tree.command(name="generate_key", description="Generate an activation key with dropdown options.")
+@admin_check()
+async def generate_key_command(interaction: discord.Interaction):
+    view = GenerateKeyView()
+    await interaction.response.send_message(
+        "Select the duration for the activation key:", 
+        view=view, 
+        ephemeral=True
+    )
+
+
+class KeyState:
+    """A parsed keys row: expiration as epoch seconds (None for lifetime), cooldown and owner."""
+
+    __slots__ = ("key", "expiration", "cooldown", "owner")
+
+    def __init__(self, key: str, expiration: int | None, cooldown: int, owner: int | None):
+        self.key = key
+        self.expiration = expiration
+        self.cooldown = cooldown
+        self.owner = owner
+
+    def expired(self, now: float | None = None) -> bool:
+        if self.expiration is None:
+            return False
+        return (time.time() if now is None else now) > self.expiration
+
+    def expiration_datetime(self) -> datetime.datetime | None:
+        return None if self.expiration is None else datetime.datetime.fromtimestamp(self.expiration)
+
+class KeyStateCache:
+    """
+    TTL + LRU cache of parsed key rows, looked up by owner and by key string.
+
+    "User has no key" is cached too, since keyless users clicking /generate are common;
+    only /activate assigns keys, and it invalidates the user. Every command that changes
+    a key (activate, key-addtime, edit_cooldown, revoke-key) invalidates it here; with shard
+    processes the coordinator pushes those invalidations to every shard.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 20_000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._by_user: OrderedDict[int, tuple[float, object]] = OrderedDict()
+        self._by_key: OrderedDict[str, tuple[float, KeyState]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, table: OrderedDict, lookup):
+        entry = table.get(lookup)
+        if entry is None:
+            return self._MISSING
+        stored_at, value = entry
+        if self.clock() - stored_at > self.ttl:
+            del table[lookup]
+            return self._MISSING
+        table.move_to_end(lookup)
+        return value
+
+    def _put(self, table: OrderedDict, lookup, value):
+        table[lookup] = (self.clock(), value)
+        table.move_to_end(lookup)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def _remember(self, state: KeyState | None, user_id: int | None = None):
+        if state is not None:
+            self._put(self._by_key, state.key, state)
+            user_id = state.owner
+        if user_id is not None:
+            self._put(self._by_user, user_id, state)
+
+    async def for_user(self, store: KeyStore, user_id: int) -> KeyState | None:
+        cached = self._get(self._by_user, user_id)
+        if cached is not self._MISSING:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        key_data = await store.by_user(user_id)
+        state = KeyState(*key_data) if key_data else None
+        self._remember(state, user_id)
+        return state
+
+    async def for_key(self, store: KeyStore, key: str) -> KeyState | None:
+        cached = self._get(self._by_key, key)
+        if cached is not self._MISSING:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        key_data = await store.by_key(key)
+        # Unknown keys are not cached: minting a key does not invalidate anything
+        if not key_data:
+            return None
+        state = KeyState(*key_data)
+        self._remember(state)
+        return state
+
+    async def refresh(self, store: KeyStore, chunk_size: int = 500):
+        """Reloads every cached owner's key in a few batched queries, resetting their TTLs."""
+        user_ids = list(self._by_user)
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            rows = await store.by_users(chunk)
+            found = {row[3]: KeyState(*row) for row in rows}
+            for user_id in chunk:
+                self._remember(found.get(user_id), user_id)
+
+    def invalidate_key(self, key: str):
+        entry = self._by_key.pop(key, None)
+        if entry is not None and entry[1].owner is not None:
+            self._by_user.pop(entry[1].owner, None)
+
+    def invalidate_user(self, user_id: int):
+        entry = self._by_user.pop(user_id, None)
+        if entry is not None and entry[1] is not None:
+            self._by_key.pop(entry[1].key, None)
+
+    def clear(self):
+        self._by_user.clear()
+        self._by_key.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "users": len(self._by_user),
+            "keys": len(self._by_key),
+        }
+
+key_cache = KeyStateCache()
+
+KEY_SWEEP_INTERVAL = 300
+KEY_SWEEP_BATCH_SIZE = 500
+
+async def archive_expired_keys(store: KeyStore, batch_size: int = KEY_SWEEP_BATCH_SIZE) -> int:
+    """
+    Moves expired keys into keys_archive in bounded batches, one short transaction each,
+    so dispenses can take the write lock between batches. Returns how many keys moved.
+    """
+    now = int(time.time())
+    swept = 0
+    while True:
+        rows = await store.archive_expired(now, batch_size)
+        for key, user_id in rows:
+            key_cache.invalidate_key(key)
+            if user_id is not None:
+                key_cache.invalidate_user(user_id)
+        swept += len(rows)
+        if len(rows) < batch_size:
+            return swept
+
+@tasks.loop(seconds=KEY_SWEEP_INTERVAL)
+async def sweep_expired_keys():
+    start = time.perf_counter()
+    # An unhandled error would stop the loop until restart; the next run retries instead
+    try:
+        swept = await archive_expired_keys(bot.stores.keys)
+        await key_cache.refresh(bot.stores.keys)
+    except Exception as e:
+        print(f"Key sweep failed: {e}")
+        traceback.print_exc()
+        return
+    print(f"Key sweep archived {swept} expired key(s) in {(time.perf_counter() - start) * 1000:.1f}ms.")
+
+async def activation_failure_reason(key: str, now: int) -> str:
+    """Explains why a guarded activation changed no row. Only runs on the failure path."""
+    key_data = await bot.stores.keys.by_key(key)
+    if not key_data:
+        # Expired keys are moved out of the keys table by the sweeper
+        return "This key has expired!" if await bot.stores.keys.is_archived(key) else "Invalid key!"
+
+    _, expiration, _, assigned_user_id = key_data
+    if assigned_user_id is not None:
+        return "This key has already been activated!"
+    if expiration is not None and expiration <= now:
+        return "This key has expired!"
+    return "Invalid key!"
+
+@bot.tree.command(name="activate", description="Activates a key.")
+@app_commands.describe(key="The activation key.")
+async def activate(interaction: Interaction, key: str):
+    user_id = interaction.user.id
+    now = int(time.time())
+
+    activated, expiration = await bot.storage.activate(key, user_id, now)
+
+    if not activated:
+        await interaction.response.send_message(await activation_failure_reason(key, now), ephemeral=True)
+        return
+
+    expiration_date = None if expiration is None else datetime.datetime.fromtimestamp(expiration)
+
+    # Inform the user of successful activation
+    if expiration_date:
+        await interaction.response.send_message(
+            f"Key activated successfully! Expires on: {expiration_date.strftime('%Y-%m-%d %H:%M:%S')}. You can now use /generate.",
+            ephemeral=True,
+        )
+    else:
+        await interaction.response.send_message(
+            "Key activated successfully with lifetime access! You can now use /generate.",
+            ephemeral=True,
+        )
+
+
+async def dispense_account(db, platform: str) -> str | None:
+    """
+    Removes exactly one account for `platform`. Returns the account text, or None when
+    the platform is out of stock. The caller credits the user via generated_stats_buffer.
+    """
+    # A single DELETE ... RETURNING is atomic, so no explicit transaction is needed.
+    # Delete by rowid so duplicate account strings are handed out one at a time
+    async with db.execute(
+        "DELETE FROM accounts WHERE id = (SELECT id FROM accounts WHERE platform = ? AND leased_at IS NULL LIMIT 1) RETURNING account",
+        (platform,)
+    ) as cursor:
+        account_data = await cursor.fetchone()
+    await db.commit()
+
+    return account_data[0] if account_data else None
+
+class DispenseEngine:
+    """
+    Serves dispenses from bounded per-platform queues of pre-leased account rows.
+
+    Rows are leased in batches (one transaction marks them with leased_at) and handed out
+    from memory. A row is deleted before its account is returned to the caller; dispenses
+    that arrive while a delete is committing share the next one (group commit), so the
+    number of write transactions stays well below the number of dispenses.
+
+    Crash safety: every row still in the table was never revealed, so leases are released
+    at shutdown and, as crash recovery, at startup without handing anything out twice.
+    """
+
+    def __init__(self, pool: DatabasePool, batch_size: int = 50, queue_size: int = 200):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.low_water = batch_size // 2
+        self.queues: dict[str, asyncio.Queue] = {}
+        self._refills: dict[str, asyncio.Task] = {}
+        # Rows taken from a queue whose delete has not committed, and the future that commit resolves
+        self._consumed: list[int] = []
+        self._committed = None
+        self._flush_task = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_seconds_total = 0.0
+        self.refill_seconds_max = 0.0
+        self.flushes = 0
+
+    async def start(self):
+        await self.release_leases()
+
+    async def close(self):
+        for task in self._refills.values():
+            task.cancel()
+        self._refills.clear()
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        self.queues.clear()
+        await self.release_leases()
+
+    async def release_leases(self):
+        """Returns every leased row to the pool. Only safe once no delete is in flight."""
+        async with self.pool.write() as db:
+            await db.execute("UPDATE accounts SET leased_at = NULL WHERE leased_at IS NOT NULL")
+            await db.commit()
+
+    def _queue(self, platform: str) -> asyncio.Queue:
+        queue = self.queues.get(platform)
+        if queue is None:
+            queue = self.queues[platform] = asyncio.Queue(maxsize=self.queue_size)
+        return queue
+
+    def _schedule_refill(self, platform: str) -> asyncio.Task:
+        task = self._refills.get(platform)
+        if task is None or task.done():
+            task = self._refills[platform] = asyncio.create_task(self._refill(platform))
+        return task
+
+    async def _refill(self, platform: str) -> int:
+        queue = self._queue(platform)
+        wanted = min(self.batch_size, self.queue_size - queue.qsize())
+        if wanted <= 0:
+            return 0
+
+        start = time.perf_counter()
+        async with self.pool.write() as db:
+            async with db.execute(
+                "UPDATE accounts SET leased_at = ? WHERE id IN "
+                "(SELECT id FROM accounts WHERE platform = ? AND leased_at IS NULL LIMIT ?) "
+                "RETURNING id, account",
+                (int(time.time()), platform, wanted)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.commit()
+
+        for row in rows:
+            queue.put_nowait(row)
+
+        elapsed = time.perf_counter() - start
+        self.refills += 1
+        self.refill_seconds_total += elapsed
+        self.refill_seconds_max = max(self.refill_seconds_max, elapsed)
+        return len(rows)
+
+    async def dispense(self, platform: str) -> str | None:
+        """Hands out one account for `platform`, or None when the platform is out of stock."""
+        queue = self._queue(platform)
+        if queue.empty():
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        while queue.empty():
+            # Concurrent callers may drain a refill before we get to it, so retry until stock runs out
+            leased = await asyncio.shield(self._schedule_refill(platform))
+            if not leased and queue.empty():
+                return None
+        account_id, account = queue.get_nowait()
+
+        if queue.qsize() < self.low_water:
+            self._schedule_refill(platform)
+        await self._consume(account_id)
+        return account
+
+    async def _consume(self, account_id: int):
+        """Waits until the row is deleted. Raises if the delete failed; the account must not be revealed then."""
+        if self._committed is None:
+            self._committed = asyncio.get_running_loop().create_future()
+        committed = self._committed
+        self._consumed.append(account_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+        await asyncio.shield(committed)
+
+    async def flush(self):
+        """Deletes consumed rows, one transaction per group, until none are waiting."""
+        while self._consumed:
+            consumed, self._consumed = self._consumed, []
+            committed, self._committed = self._committed, None
+            try:
+                async with self.pool.write() as db:
+                    await db.execute("BEGIN IMMEDIATE")
+                    await db.executemany("DELETE FROM accounts WHERE id = ?", ((account_id,) for account_id in consumed))
+                    await db.commit()
+            except asyncio.CancelledError:
+                committed.cancel()
+                raise
+            except Exception as e:
+                # The rows stay leased and unrevealed, so startup recovery returns them as stock
+                print(f"Error deleting dispensed accounts: {e}")
+                committed.set_exception(e)
+                continue
+            self.flushes += 1
+            committed.set_result(None)
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "queue_depth": {platform: queue.qsize() for platform, queue in self.queues.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "refills": self.refills,
+            "refill_avg_ms": self.refill_seconds_total / self.refills * 1000 if self.refills else 0.0,
+            "refill_max_ms": self.refill_seconds_max * 1000,
+            "flushes": self.flushes,
+        }
+
+class CooldownTracker:
+    """
+    Last-dispense time and key cooldown per user, held in memory so a user still on
+    cooldown is rejected without touching SQLite.
+
+    Entries are persisted lazily to dispense_cooldowns by a periodic flush and on shutdown,
+    and reloaded at startup. Entries whose cooldown has elapsed carry no information and are
+    evicted, oldest first; past `max_users` every elapsed entry is swept out. A running window
+    is never dropped: its user could dispense early, and the flush would delete its row.
+    """
+
+    # Seconds between full sweeps while past max_users, which only running windows keep it
+    SWEEP_INTERVAL = 1.0
+
+    def __init__(self, clock=time.time, max_users: int = 50_000):
+        self.clock = clock
+        self.max_users = max_users
+        self._swept_at = None
+        self.loaded = False
+        # user_id -> (last_dispense, cooldown), ordered by last dispense
+        self._entries: OrderedDict[int, tuple[float, int]] = OrderedDict()
+        self._dirty: set[int] = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def remaining(self, user_id: int) -> float:
+        """Seconds until `user_id` may dispense again; 0 when they are free to."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return 0.0
+        last_dispense, cooldown = entry
+        return max(0.0, last_dispense + cooldown - self.clock())
+
+    def try_acquire(self, user_id: int, cooldown: int) -> tuple[bool, tuple[float, int] | None]:
+        """
+        Starts a cooldown window for `user_id` unless one is running.
+        Returns (acquired, previous entry); pass the previous entry to `release` if the dispense fails.
+        """
+        if self.remaining(user_id) > 0:
+            return False, None
+        previous = self._entries.pop(user_id, None)
+        if cooldown > 0:
+            self._entries[user_id] = (self.clock(), cooldown)
+            self._dirty.add(user_id)
+            self._evict()
+        return True, previous
+
+    def release(self, user_id: int, previous: tuple[float, int] | None):
+        """Undoes `try_acquire` after a dispense that handed nothing out."""
+        self._entries.pop(user_id, None)
+        if previous is not None:
+            self._entries[user_id] = previous
+            self._entries.move_to_end(user_id, last=False)
+        self._dirty.add(user_id)
+
+    def set_cooldown(self, user_id: int, cooldown: int):
+        """Applies an edited key cooldown to a running window."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries[user_id] = (entry[0], cooldown)
+            self._dirty.add(user_id)
+
+    def _evict(self):
+        now = self.clock()
+        while self._entries:
+            user_id, (last_dispense, cooldown) = next(iter(self._entries.items()))
+            if last_dispense + cooldown > now:
+                break
+            del self._entries[user_id]
+            self._dirty.add(user_id)
+        if len(self._entries) <= self.max_users:
+            return
+        # Elapsed windows can sit behind longer ones still running
+        if self._swept_at is not None and now - self._swept_at < self.SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for user_id, (last_dispense, cooldown) in list(self._entries.items()):
+            if last_dispense + cooldown <= now:
+                del self._entries[user_id]
+                self._dirty.add(user_id)
+
+    async def load(self, store: StatsStore):
+        rows = await store.load_cooldowns(self.clock())
+        self._entries = OrderedDict((user_id, (last_dispense, cooldown)) for user_id, last_dispense, cooldown in rows)
+        self._dirty.clear()
+        self._evict()
+        self.loaded = True
+
+    async def flush(self, store: StatsStore):
+        """Writes changed entries and drops rows whose cooldown has elapsed."""
+        self._evict()
+        dirty, self._dirty = self._dirty, set()
+        changed = [(user_id, *self._entries[user_id]) for user_id in dirty if user_id in self._entries]
+        removed = [user_id for user_id in dirty if user_id not in self._entries]
+        try:
+            await store.save_cooldowns(changed, removed, self.clock())
+        except BaseException:
+            self._dirty |= dirty
+            raise
+
+cooldown_tracker = CooldownTracker()
+
+@tasks.loop(seconds=30)
+async def flush_cooldowns():
+    # Failed entries stay dirty, so logging and returning lets the next run retry them
+    try:
+        await cooldown_tracker.flush(bot.stores.stats)
+    except Exception as e:
+        print(f"Cooldown flush failed: {e}")
+        traceback.print_exc()
+
+STATS_FLUSH_INTERVAL = 5
+
+def log_task_failure(label: str):
+    """Done-callback for background tasks: logs an exception instead of leaving it unretrieved."""
+    def callback(task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        error = task.exception()
+        print(f"{label} failed: {error}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+    return callback
+
+class GeneratedStatsBuffer:
+    """
+    Write-behind buffer for generated_stats: per-user increments are aggregated in memory
+    and written as one UPSERT executemany, off the dispense path.
+
+    Flushed every STATS_FLUSH_INTERVAL seconds, when `flush_size` increments are pending,
+    and on shutdown. Increments stay pending until their flush commits, so a failed flush
+    is retried and readers can add pending() to the stored count.
+
+    Crash safety: a hard crash loses the increments buffered since the last flush (at most
+    a few seconds' worth). Only the per-user counters undercount; dispensed accounts were
+    already deleted in their own transaction, so stock is never handed out twice.
+    """
+
+    def __init__(self, flush_size: int = 500):
+        self.flush_size = flush_size
+        self._pending = Counter()
+        self._buffered = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        # Cleared while a flush is writing; epoch changes whenever one finishes
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.epoch = 0
+
+    def __len__(self) -> int:
+        return self._buffered
+
+    def record(self, user_id: int, count: int = 1) -> bool:
+        """Buffers `count` dispenses for the user. Returns True once the buffer should be flushed."""
+        self._pending[user_id] += count
+        self._buffered += count
+        return self._buffered >= self.flush_size
+
+    def pending(self, user_id: int) -> int:
+        return self._pending.get(user_id, 0)
+
+    def schedule_flush(self, store: StatsStore):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush(store))
+            self._flush_task.add_done_callback(log_task_failure("Generated stats flush"))
+
+    async def flush(self, store: StatsStore) -> int:
+        """Writes every pending increment in one transaction. Returns the number flushed."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch = dict(self._pending)
+            self._idle.clear()
+            try:
+                await store.add_generated(batch)
+                # Increments recorded while the write ran stay pending for the next flush
+                for user_id, count in batch.items():
+                    remaining = self._pending[user_id] - count
+                    if remaining:
+                        self._pending[user_id] = remaining
+                    else:
+                        del self._pending[user_id]
+                flushed = sum(batch.values())
+                self._buffered -= flushed
+                return flushed
+            finally:
+                self.epoch += 1
+                self._idle.set()
+
+    async def generated_count(self, store: StatsStore, user_id: int) -> int:
+        """Stored plus pending count for the user, exact even while a flush is committing."""
+        while True:
+            await self._idle.wait()
+            epoch = self.epoch
+            stored = await store.generated_count(user_id)
+            # A flush that overlapped the read may or may not be visible in it, so read again
+            if self._idle.is_set() and self.epoch == epoch:
+                return stored + self.pending(user_id)
+
+generated_stats_buffer = GeneratedStatsBuffer()
+
+@tasks.loop(seconds=STATS_FLUSH_INTERVAL)
+async def flush_generated_stats():
+    # Increments stay pending after a failed flush, so the next run retries them
+    try:
+        await generated_stats_buffer.flush(bot.stores.stats)
+    except Exception as e:
+        print(f"Generated stats flush failed: {e}")
+        traceback.print_exc()
+
+EVENT_JOURNAL_CAPACITY = 50_000
+
+journal_events_dropped = metrics.counter("bot_journal_events_dropped_total", "Journal events dropped because the buffer was full.")
+
+class EventJournal:
+    """
+    Ring buffer in front of the events table: dispenses, activations, revocations and
+    extensions are recorded in memory and appended in batches, off the command path.
+
+    Flushed every STATS_FLUSH_INTERVAL seconds, when `flush_size` events are pending, and
+    on shutdown. If the database falls behind long enough to fill the ring, the oldest
+    events are dropped (and counted) rather than slowing dispenses down.
+
+    Crash safety: as with generated_stats, a hard crash loses the last few seconds of
+    events. The journal is a record for trends, not the source of truth for any key.
+    """
+
+    def __init__(self, capacity: int = EVENT_JOURNAL_CAPACITY, flush_size: int = 500, clock=time.time):
+        self.flush_size = flush_size
+        self.clock = clock
+        self._events = deque(maxlen=capacity)
+        # Events ever recorded; positions the ring so a flush removes only what it wrote
+        self._recorded = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def record(self, kind: str, user_id: int | None, platform: str | None = None,
+               key: str | None = None, amount: int | None = None) -> bool:
+        """Buffers one event. Returns True once the journal should be flushed."""
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+            journal_events_dropped.inc()
+        self._events.append((int(self.clock()), kind, user_id, platform, key, amount))
+        self._recorded += 1
+        return len(self._events) >= self.flush_size
+
+    def schedule_flush(self, store: StatsStore):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush(store))
+            self._flush_task.add_done_callback(log_task_failure("Event journal flush"))
+
+    async def flush(self, store: StatsStore) -> int:
+        """Appends every buffered event in one transaction. Returns the number written."""
+        async with self._flush_lock:
+            if not self._events:
+                return 0
+            batch = list(self._events)
+            written_through = self._recorded - len(self._events) + len(batch)
+            await store.append_events(batch)
+            # Events recorded while the write ran stay buffered; any the ring dropped meanwhile are already gone
+            first = self._recorded - len(self._events)
+            for _ in range(max(0, written_through - first)):
+                self._events.popleft()
+            return len(batch)
+
+event_journal = EventJournal()
+
+def record_event(kind: str, user_id: int | None, platform: str | None = None,
+                 key: str | None = None, amount: int | None = None):
+    if event_journal.record(kind, user_id, platform, key, amount):
+        event_journal.schedule_flush(bot.stores.stats)
+
+@tasks.loop(seconds=STATS_FLUSH_INTERVAL)
+async def flush_event_journal():
+    # Events stay buffered after a failed flush, so the next run retries them
+    try:
+        await event_journal.flush(bot.stores.stats)
+    except Exception as e:
+        print(f"Event journal flush failed: {e}")
+        traceback.print_exc()
+
+# Snapshots of the SQLite file. With DATABASE_URL set they cover the bot metadata only;
+# back Postgres up with its own tools
+BACKUP_DIR = "database/backups"
+BACKUP_INTERVAL_HOURS = 6
+BACKUP_KEEP = 8
+BACKUP_PAGES_PER_STEP = 1024
+
+def list_backups(source_path: str, directory: str = BACKUP_DIR) -> list[str]:
+    """Snapshots of `source_path` in `directory`, oldest first."""
+    prefix = os.path.splitext(os.path.basename(source_path))[0] + "-"
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(prefix) and name.endswith(".db")
+    )
+
+async def backup_database(source_path: str, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP,
+                          pages: int = BACKUP_PAGES_PER_STEP) -> str:
+    """
+    Copies the live database into a timestamped file in `directory` with SQLite's online
+    backup API, `pages` pages per step, then deletes all but the newest `keep` snapshots.
+    Returns the new snapshot's path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path = os.path.join(directory, f"{stem}-{datetime.datetime.now():%Y%m%d-%H%M%S}.db")
+    # Written under another name first, so a crash never leaves a torn file that looks complete
+    partial = path + ".partial"
+    try:
+        async with aiosqlite.connect(source_path) as source, aiosqlite.connect(partial) as target:
+            # Copying inside one read transaction pins a WAL snapshot: writers carry on, and their
+            # commits no longer restart the backup between steps
+            await source.execute("BEGIN")
+            await source.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+            await source.backup(target, pages=pages)
+            await source.rollback()
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+    for stale in list_backups(source_path, directory)[:-keep]:
+        os.remove(stale)
+    return path
+
+@tasks.loop(hours=BACKUP_INTERVAL_HOURS)
+async def backup_snapshots():
+    backups = list_backups(bot.db.path)
+    # The loop also fires at startup; skip it if the last snapshot is recent, so restarts
+    # do not rotate older snapshots away
+    if backups and time.time() - os.path.getmtime(backups[-1]) < BACKUP_INTERVAL_HOURS * 3600:
+        return
+    start = time.perf_counter()
+    try:
+        path = await backup_database(bot.db.path)
+    except (OSError, aiosqlite.Error) as e:
+        print(f"Database backup failed: {e}")
+        return
+    print(f"Backed up the database to {path} in {time.perf_counter() - start:.1f}s.")
+
+class StorageBackend:
+    """
+    Writes that must be serialized through the single process owning the database:
+    dispensing (with its cooldown and stats credit), key activation and key changes.
+
+    LocalStorage runs them in this process. CoordinatorStorage forwards them to a coordinator
+    process so shard processes never race each other on cooldowns or buffered counters.
+    Writes other processes cache (keys, admins) go through here too, so the coordinator can
+    push the invalidations to every shard. Reads go straight to bot.stores.
+    """
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def dispense(self, platform: str, user_id: int, cooldown: int) -> tuple[str | None, float | None]:
+        """Starts the user's cooldown and hands out one account.
+        Returns (account, 0), (None, seconds left) when on cooldown, (None, 0) when out of stock,
+        or (None, None) when the coordinator finds the user's key gone or expired."""
+        raise NotImplementedError
+
+    async def activate(self, key: str, user_id: int, now: int) -> tuple[bool, int | None]:
+        """Claims an unassigned, unexpired key. Returns (activated, expiration)."""
+        raise NotImplementedError
+
+    async def insert_keys(self, keys: list[str], expiration: datetime.datetime | None, duration: str, cooldown: int):
+        raise NotImplementedError
+
+    async def revoke_key(self, key: str) -> tuple[bool, int | None]:
+        """Deletes one key. Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def revoke_user_batch(self, user_id: int, limit: int) -> list[str]:
+        """Deletes up to `limit` of the user's keys. Returns the keys deleted."""
+        raise NotImplementedError
+
+    async def make_lifetime(self, key: str) -> tuple[bool, int | None]:
+        """Clears a key's expiration. Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def extend(self, key: str, seconds: int, now: int) -> tuple[bool, int | None, int | None]:
+        """Adds time to a key, from now if it has none. Returns (existed, new expiration, owner)."""
+        raise NotImplementedError
+
+    async def set_cooldown(self, key: str, cooldown: int) -> tuple[bool, int | None]:
+        """Changes a key's cooldown, including a window its owner is already in. Returns (existed, owner)."""
+        raise NotImplementedError
+
+    async def generated_count(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    async def add_admin_user(self, user_id: int):
+        raise NotImplementedError
+
+    async def add_admin_role(self, role_id: int):
+        raise NotImplementedError
+
+def apply_cache_change(change: dict):
+    """Applies a change the coordinator pushed from another process to this one's caches."""
+    for user_id in change.get("admin_users", ()):
+        admin_cache.add_user(user_id)
+    for role_id in change.get("admin_roles", ()):
+        admin_cache.add_role(role_id)
+    for key in change.get("keys", ()):
+        key_cache.invalidate_key(key)
+    for user_id in change.get("users", ()):
+        key_cache.invalidate_user(user_id)
+
+async def resync_caches():
+    """Reloads the pushed caches after a coordinator disconnect, during which pushes were missed."""
+    key_cache.clear()
+    if bot.stores is None:
+        return
+    try:
+        await admin_cache.load(bot.stores.admins)
+    except Exception as e:
+        print(f"Reloading caches after a coordinator reconnect failed: {e}")
+        traceback.print_exc()
+
+class LocalStorage(StorageBackend):
+    """The default backend: the repositories in `stores`, plus this process's cooldown and stats buffers."""
+
+    def __init__(self, stores: Stores):
+        self.stores = stores
+        # Set by the coordinator to forward cache changes to every shard
+        self.publish = None
+
+    def _publish(self, change: dict):
+        if self.publish is not None:
+            self.publish(change)
+
+    def _invalidate_key(self, key: str, user_id: int | None):
+        key_cache.invalidate_key(key)
+        if user_id is not None:
+            key_cache.invalidate_user(user_id)
+        self._publish({"keys": [key], "users": [] if user_id is None else [user_id]})
+
+    async def dispense(self, platform, user_id, cooldown):
+        acquired, previous = cooldown_tracker.try_acquire(user_id, cooldown or 0)
+        if not acquired:
+            return None, cooldown_tracker.remaining(user_id)
         try:
-            expiration_timedelta = parse_duration(self.duration)
-            if expiration_timedelta is None:  # 'lifetime' case
-                expiration = None
+            if bot.dispenser is not None:
+                account = await bot.dispenser.dispense(platform)
             else:
-                expiration = datetime.datetime.now() + expiration_timedelta
-        except ValueError as e:
-            await interaction.response.send_message(str(e), ephemeral=True)
-            return
-
-        # Generate a key starting with BEZIICPREM-
-        key = 'BEZIICPREM-' + ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890', k=10))
+                account = await self.stores.accounts.dispense(platform)
+        except BaseException:
+            cooldown_tracker.release(user_id, previous)
+            raise
+        if account is None:
+            cooldown_tracker.release(user_id, previous)
+            return None, 0.0
+        if generated_stats_buffer.record(user_id):
+            generated_stats_buffer.schedule_flush(self.stores.stats)
+        record_event("dispense", user_id, platform)
+        return account, 0.0
+
+    async def activate(self, key, user_id, now):
+        # Claim the key in one guarded statement: exactly one of several concurrent redeemers wins
+        activated, expiration = await self.stores.keys.activate(key, user_id, now)
+        if activated:
+            self._invalidate_key(key, user_id)
+            record_event("activate", user_id, key=key)
+        return activated, expiration
+
+    async def insert_keys(self, keys, expiration, duration, cooldown):
+        expiration_value = int(expiration.timestamp()) if expiration else None
+        await self.stores.keys.insert(keys, expiration_value, duration, cooldown)
+
+    async def revoke_key(self, key):
+        existed, owner = await self.stores.keys.revoke(key)
+        if existed:
+            self._invalidate_key(key, owner)
+            record_event("revoke", owner, key=key)
+        return existed, owner
+
+    async def revoke_user_batch(self, user_id, limit):
+        keys = await self.stores.keys.revoke_user_batch(user_id, limit)
+        if keys:
+            key_cache.invalidate_user(user_id)
+            for key in keys:
+                key_cache.invalidate_key(key)
+                record_event("revoke", user_id, key=key)
+            self._publish({"keys": keys, "users": [user_id]})
+        return keys
+
+    async def make_lifetime(self, key):
+        existed, owner = await self.stores.keys.make_lifetime(key)
+        if existed:
+            self._invalidate_key(key, owner)
+            record_event("extend", owner, key=key)
+        return existed, owner
+
+    async def extend(self, key, seconds, now):
+        existed, expiration, owner = await self.stores.keys.extend(key, seconds, now)
+        if existed:
+            self._invalidate_key(key, owner)
+            record_event("extend", owner, key=key, amount=seconds)
+        return existed, expiration, owner
+
+    async def set_cooldown(self, key, cooldown):
+        # Update the cooldown for the key, learning its owner in the same statement
+        existed, owner = await self.stores.keys.set_cooldown(key, cooldown)
+        if existed:
+            self._invalidate_key(key, owner)
+        if owner is not None:
+            cooldown_tracker.set_cooldown(owner, cooldown)
+        return existed, owner
+
+    async def generated_count(self, user_id):
+        return await generated_stats_buffer.generated_count(self.stores.stats, user_id)
+
+    async def add_admin_user(self, user_id):
+        await self.stores.admins.add_user(user_id)
+        admin_cache.add_user(user_id)
+        self._publish({"admin_users": [user_id]})
+
+    async def add_admin_role(self, role_id):
+        await self.stores.admins.add_role(role_id)
+        admin_cache.add_role(role_id)
+        self._publish({"admin_roles": [role_id]})
+
+class CoordinatorError(Exception):
+    """A coordinator call failed remotely, or the connection to the coordinator was lost."""
+
+def _write_frame(writer: asyncio.StreamWriter, payload):
+    # Frames are a 4-byte big-endian length followed by a JSON body
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    writer.write(len(data).to_bytes(4, "big") + data)
+
+async def _read_frame(reader: asyncio.StreamReader):
+    """Returns the next decoded frame, or None at end of stream."""
+    try:
+        header = await reader.readexactly(4)
+        return json.loads(await reader.readexactly(int.from_bytes(header, "big")))
+    except asyncio.IncompleteReadError:
+        return None
 
-        async with aiosqlite.connect(DB_FILE) as db:
-            await db.execute("INSERT INTO keys (key, expiration, cooldown, user_id) VALUES (?, ?, ?, NULL)", 
-                             (key, expiration, cooldown))
-            await db.commit()
+class CoordinatorStorage(StorageBackend):
+    """
+    Client side of the coordinator protocol. Calls made in the same event-loop tick are
+    sent as one frame ([[id, operation, args], ...]) and answered as one frame of
+    [id, ok, result-or-error], so concurrent interactions share a single round trip.
+    The coordinator also pushes cache changes made by any shard as {...} frames.
 
-        expiration_message = "Lifetime" if expiration is None else f"Expires in: {expiration_timedelta}"
-        embed = discord.Embed(
-            description=(
-                f"Generated key: `{key}`\n"
-                f"{expiration_message}\n"
-                f"Cooldown: {cooldown} seconds"
-            ),
-            color=discord.Color.green()
-        )
-        await interaction.response.send_message(embed=embed)
+    If the connection drops (say the coordinator restarts), calls fail with
+    CoordinatorError while the client reconnects in the background with backoff.
+    """
 
-class GenerateKeyView(View):
-    def __init__(self):
-        super().__init__()
-        self.add_item(DurationDropdown())
+    RECONNECT_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 30.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._reconnector = None
+        self._closed = False
+        self._outbox = []
+        self._waiters = {}
+        self._next_id = 1
+        self.calls = 0
+        self.frames = 0
+        self.reconnects = 0
+
+    async def open(self):
+        self._closed = False
+        await self._connect()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def close(self):
+        self._closed = True
+        if self._reconnector is not None:
+            self._reconnector.cancel()
+            self._reconnector = None
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        self._receiver.cancel()
+        self._writer = None
+
+    async def _reconnect(self):
+        delay = self.RECONNECT_DELAY
+        while not self._closed:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+            except OSError as e:
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                print(f"Coordinator reconnect failed: {e}; retrying in {delay:.1f}s")
+                continue
+            print("Reconnected to the coordinator.")
+            await resync_caches()
+            self.reconnects += 1
+            return
 
-@bot.tree.command(name="generate_key", description="Generate an activation key with dropdown options.")
-async def generate_key_command(interaction: discord.Interaction):
-    await admin_only(interaction)
-    view = GenerateKeyView()
-    await interaction.response.send_message(
-        "Select the duration for the activation key:", 
-        view=view, 
-        ephemeral=True
-    )
+    async def _call(self, operation: str, *args):
+        if self._writer is None or self._writer.is_closing():
+            raise CoordinatorError("not connected to the coordinator")
+        call_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[call_id] = future
+        if not self._outbox:
+            asyncio.get_running_loop().call_soon(self._send)
+        self._outbox.append([call_id, operation, list(args)])
+        return await future
+
+    def _send(self):
+        batch, self._outbox = self._outbox, []
+        if self._writer is None or self._writer.is_closing():
+            for call_id, _, _ in batch:
+                self._fail(call_id, "not connected to the coordinator")
+            return
+        self.calls += len(batch)
+        self.frames += 1
+        _write_frame(self._writer, batch)
 
+    def _fail(self, call_id: int, message: str):
+        future = self._waiters.pop(call_id, None)
+        if future is not None and not future.done():
+            future.set_exception(CoordinatorError(message))
 
-@bot.tree.command(name="activate", description="Activates a key.")
-@app_commands.describe(key="The activation key.")
-async def activate(interaction: Interaction, key: str):
-    user_id = interaction.user.id
+    async def _receive(self):
+        try:
+            while (frame := await _read_frame(self._reader)) is not None:
+                if isinstance(frame, dict):
+                    apply_cache_change(frame)
+                    continue
+                for call_id, ok, value in frame:
+                    future = self._waiters.pop(call_id, None)
+                    # The caller may have been cancelled while waiting
+                    if future is None or future.done():
+                        continue
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(CoordinatorError(value))
+        except ConnectionError as e:
+            print(f"Lost connection to the coordinator: {e}")
+        finally:
+            for call_id in list(self._waiters):
+                self._fail(call_id, "lost connection to the coordinator")
+            if not self._closed:
+                self._writer.close()
+                self._reconnector = asyncio.create_task(self._reconnect())
+
+    async def dispense(self, platform, user_id, cooldown):
+        account, retry_after = await self._call("dispense", platform, user_id, cooldown)
+        return account, retry_after
+
+    async def activate(self, key, user_id, now):
+        activated, expiration = await self._call("activate", key, user_id, now)
+        return activated, expiration
+
+    async def insert_keys(self, keys, expiration, duration, cooldown):
+        await self._call("insert_keys", keys, expiration.timestamp() if expiration else None, duration, cooldown)
+
+    async def revoke_key(self, key):
+        existed, owner = await self._call("revoke_key", key)
+        return existed, owner
+
+    async def revoke_user_batch(self, user_id, limit):
+        return await self._call("revoke_user_batch", user_id, limit)
+
+    async def make_lifetime(self, key):
+        existed, owner = await self._call("make_lifetime", key)
+        return existed, owner
+
+    async def extend(self, key, seconds, now):
+        existed, expiration, owner = await self._call("extend", key, seconds, now)
+        return existed, expiration, owner
+
+    async def set_cooldown(self, key, cooldown):
+        existed, owner = await self._call("set_cooldown", key, cooldown)
+        return existed, owner
+
+    async def generated_count(self, user_id):
+        return await self._call("generated_count", user_id)
+
+    # The coordinator's push updates this process's admin cache before the call returns
+    async def add_admin_user(self, user_id):
+        await self._call("add_admin_user", user_id)
+
+    async def add_admin_role(self, role_id):
+        await self._call("add_admin_role", role_id)
+
+class DispenseCoordinator:
+    """
+    Serves StorageBackend calls from shard processes over a Unix socket, running them on
+    a LocalStorage. Each incoming frame is handled concurrently with the others, and its
+    results go back as one frame. Cache changes the storage publishes are pushed to every client.
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT expiration, user_id FROM keys WHERE key = ?", (key,)) as cursor:
-            key_data = await cursor.fetchone()
-            
-            if not key_data:
-                await interaction.response.send_message("Invalid key!", ephemeral=True)
-                return
+    Shards decide from cached key state that another shard may have changed since, so a
+    dispense re-checks the key here, where every key write passes, and uses its cooldown.
+    """
 
-            expiration, assigned_user_id = key_data
-            
-            # Check if the key is lifetime or expired
-            if expiration:
-                expiration_date = datetime.datetime.fromisoformat(expiration)
-                if datetime.datetime.now() > expiration_date:
-                    await interaction.response.send_message("This key has expired!", ephemeral=True)
-                    return
-            else:
-                # Lifetime key handling (no expiration date to check)
-                expiration_date = None
+    OPERATIONS = ("dispense", "activate", "insert_keys", "revoke_key", "revoke_user_batch", "make_lifetime",
+                  "extend", "set_cooldown", "generated_count", "add_admin_user", "add_admin_role")
+
+    def __init__(self, storage: LocalStorage, path: str):
+        self.storage = storage
+        self.path = path
+        self._server = None
+        self._clients: set[asyncio.StreamWriter] = set()
+        self._serving: set[asyncio.Task] = set()
+        storage.publish = self.broadcast
+
+    async def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # A socket file left by a crashed coordinator would make bind fail
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_client, path=self.path)
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        # Connections outlive the listening socket; end them while the loop still runs
+        serving = list(self._serving)
+        for task in serving:
+            task.cancel()
+        await asyncio.gather(*serving, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def dispense(self, platform, user_id, cooldown):
+        key_state = await key_cache.for_user(self.storage.stores.keys, user_id)
+        if key_state is None or key_state.expired():
+            return None, None
+        return await self.storage.dispense(platform, user_id, key_state.cooldown)
+
+    def broadcast(self, change: dict):
+        # Written before the result frame of the call that made the change
+        for writer in self._clients:
+            if not writer.is_closing():
+                _write_frame(writer, change)
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pending = set()
+        self._clients.add(writer)
+        self._serving.add(asyncio.current_task())
+        try:
+            while (frame := await _read_frame(reader)) is not None:
+                task = asyncio.create_task(self._run_batch(frame, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        except asyncio.CancelledError:
+            # Only close() cancels; asyncio logs a connection task that ends cancelled as an error
+            for task in pending:
+                task.cancel()
+        finally:
+            self._serving.discard(asyncio.current_task())
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _run_batch(self, batch: list, writer: asyncio.StreamWriter):
+        results = await asyncio.gather(*(self._run(*call) for call in batch))
+        if not writer.is_closing():
+            _write_frame(writer, results)
+
+    async def _run(self, call_id: int, operation: str, args: list):
+        if operation not in self.OPERATIONS:
+            return [call_id, False, f"unknown operation {operation!r}"]
+        if operation == "insert_keys" and args[1] is not None:
+            args[1] = datetime.datetime.fromtimestamp(args[1])
+        # Operations this class defines re-check the shard's view before reaching the storage
+        handler = getattr(self, operation, None) or getattr(self.storage, operation)
+        try:
+            return [call_id, True, await handler(*args)]
+        except Exception as e:
+            print(f"Coordinator {operation} failed: {e}")
+            return [call_id, False, f"{type(e).__name__}: {e}"]
+
+async def run_coordinator(db_file: str = DB_FILE, socket_path: str = COORDINATOR_SOCKET):
+    """Owns the database for a set of shard processes until SIGINT/SIGTERM."""
+    bot.db = DatabasePool(db_file)
+    await bot.db.open()
+    await initialize_database()
+    bot.stores = await open_stores(bot.db)
+    await cooldown_tracker.load(bot.stores.stats)
+    if DISPENSE_PREFETCH and not DATABASE_URL:
+        bot.dispenser = DispenseEngine(bot.db)
+        await bot.dispenser.start()
+    coordinator = DispenseCoordinator(LocalStorage(bot.stores), socket_path)
+    await coordinator.start()
+    sweep_expired_keys.start()
+    flush_cooldowns.start()
+    flush_generated_stats.start()
+    flush_event_journal.start()
+    backup_snapshots.start()
+    dedupe = asyncio.create_task(dedupe_accounts(bot.stores.accounts))
+    print(f"Coordinator serving {db_file} on {socket_path}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        await coordinator.close()
+        dedupe.cancel()
+        sweep_expired_keys.cancel()
+        flush_cooldowns.cancel()
+        flush_generated_stats.cancel()
+        flush_event_journal.cancel()
+        backup_snapshots.cancel()
+        if bot.dispenser is not None:
+            await bot.dispenser.close()
+        await cooldown_tracker.flush(bot.stores.stats)
+        await generated_stats_buffer.flush(bot.stores.stats)
+        await event_journal.flush(bot.stores.stats)
+        await bot.stores.close()
+        await bot.db.close()
+        print("Coordinator stopped.")
+
+async def handle_account_generation(interaction: Interaction, selected_platform: str, cooldown: int = 0) -> str | None:
+    """Dispenses one account to the user and replies with it. Returns the account, or None if refused."""
+    user_id = interaction.user.id
 
-            # Check if the key is already assigned
-            if assigned_user_id is not None:
-                await interaction.response.send_message("This key has already been activated!", ephemeral=True)
-                return
+    account, retry_after = await bot.storage.dispense(selected_platform, user_id, cooldown)
 
-        # Update the key's assigned user
-        await db.execute("UPDATE keys SET user_id = ? WHERE key = ?", (user_id, key))
-        await db.commit()
+    if retry_after is None:
+        await interaction.response.send_message(
+            "You don't have an active key! Activate a key first.", ephemeral=True
+        )
+        return None
 
-    # Inform the user of successful activation
-    if expiration_date:
+    if retry_after > 0:
         await interaction.response.send_message(
-            f"Key activated successfully! Expires on: {expiration_date.strftime('%Y-%m-%d %H:%M:%S')}. You can now use /generate.",
-            ephemeral=True,
+            f"You're on cooldown! Try again in {math.ceil(retry_after)} seconds.", ephemeral=True
         )
-    else:
+        return None
+
+    if account is None:
         await interaction.response.send_message(
-            "Key activated successfully with lifetime access! You can now use /generate.",
+            f"No accounts available for the platform '{selected_platform}'.",
             ephemeral=True,
         )
+        return None
 
+    dispenses_total.inc(platform=selected_platform)
+    await interaction.response.send_message(
+        f"Here is your generated account for {selected_platform}: `{account}`",
+        ephemeral=True,
+    )
+    return account
+
+@metrics.gauge("bot_inventory_available", "Accounts in stock, by platform.")
+async def collect_inventory():
+    rows = await bot.stores.accounts.inventory()
+    return {(("platform", platform),): available for platform, available in rows}
+
+@metrics.gauge("bot_cache_entries", "Entries held by in-memory caches.")
+async def collect_cache_sizes():
+    key_metrics = key_cache.metrics()
+    return {
+        (("cache", "key_state_users"),): key_metrics["users"],
+        (("cache", "key_state_keys"),): key_metrics["keys"],
+        (("cache", "cooldowns"),): len(cooldown_tracker),
+        (("cache", "pending_generated_stats"),): len(generated_stats_buffer),
+        (("cache", "pending_journal_events"),): len(event_journal),
+    }
 
-async def handle_account_generation(interaction: Interaction, selected_platform: str):
-    user_id = interaction.user.id
+@metrics.gauge("bot_dispense_queue_depth", "Pre-leased accounts queued by the dispense engine, by platform.")
+async def collect_dispense_queues():
+    if bot.dispenser is None:
+        return {}
+    depths = bot.dispenser.metrics()["queue_depth"]
+    return {(("platform", platform),): depth for platform, depth in depths.items()}
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Fetch one account for the selected platform
-        async with db.execute(
-            "SELECT account FROM accounts WHERE platform = ? LIMIT 1",
-            (selected_platform,)
-        ) as cursor:
-            account_data = await cursor.fetchone()
-            if not account_data:
-                await interaction.response.send_message(
-                    f"No accounts available for the platform '{selected_platform}'.",
-                    ephemeral=True,
-                )
-                return
+@metrics.gauge("bot_command_queue_depth", "Commands waiting for an executor slot, by priority.")
+async def collect_command_queue():
+    return {(("priority", name),): command_executor.queued(priority) for priority, name in enumerate(PRIORITY_NAMES)}
 
-            account = account_data[0]
+class GeneratePlatformSelect(discord.ui.DynamicItem[Select], template=r"generate:platform"):
+    """
+    The /generate platform dropdown. Its custom_id is fixed and everything else comes from the
+    click itself (the user and the chosen platform), so sent menus hold no per-menu state in
+    the view store and keep working after a restart.
+    """
 
-        # Delete the fetched account
-        async with db.execute(
-            "DELETE FROM accounts WHERE platform = ? AND account = ?",
-            (selected_platform, account)
-        ):
-            await db.commit()
+    def __init__(self, options=()):
+        super().__init__(Select(
+            placeholder="Select a platform",
+            min_values=1,
+            max_values=1,
+            options=list(options),
+            custom_id="generate:platform",
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Select, match: re.Match):
+        return cls(item.options)
+
+    async def callback(self, interaction: Interaction):
+        user_id = interaction.user.id
+        selected_platform = self.item.values[0]
+
+        # Reject users still on cooldown before doing any database work
+        remaining = cooldown_tracker.remaining(user_id)
+        if remaining > 0:
+            await interaction.response.send_message(
+                f"You're on cooldown! Try again in {math.ceil(remaining)} seconds.", ephemeral=True
+            )
+            return
 
-        # Update user-generated statistics
-        async with db.execute(
-            "SELECT generated_count FROM generated_stats WHERE user_id = ?",
-            (user_id,)
-        ) as cursor:
-            user_stats = await cursor.fetchone()
-            if user_stats:
-                await db.execute(
-                    "UPDATE generated_stats SET generated_count = generated_count + 1 WHERE user_id = ?",
-                    (user_id,)
-                )
-            else:
-                await db.execute(
-                    "INSERT INTO generated_stats (user_id, generated_count) VALUES (?, 1)",
-                    (user_id,)
-                )
-            await db.commit()
+        # Check if the user has an active key
+        key_state = await key_cache.for_user(bot.stores.keys, user_id)
+        if key_state is None:
+            await interaction.response.send_message(
+                "You don't have an active key! Activate a key first.", ephemeral=True
+            )
+            return
 
-    await interaction.response.send_message(
-        f"Here is your generated account for {selected_platform}: `{account}`",
-        ephemeral=True,
-    )
+        if key_state.expired():
+            await interaction.response.send_message(
+                "Your key has expired! Activate a new key to continue.", ephemeral=True
+            )
+            return
+
+        # The storage backend re-checks the cooldown atomically: another click may have
+        # started a window while we awaited the key
+        await handle_account_generation(interaction, selected_platform, key_state.cooldown)
 
 @bot.tree.command(name="generate", description="Generate an account.")
 async def generate(interaction: Interaction):
-    user_id = interaction.user.id
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Fetch available platforms for the dropdown
-        async with db.execute("SELECT DISTINCT platform FROM accounts") as cursor:
-            platforms = await cursor.fetchall()
-
-        if not platforms:
-            await interaction.response.send_message("No platforms are available.", ephemeral=True)
-            return
+    # Fetch available platforms for the dropdown
+    platforms = await bot.stores.accounts.inventory()
 
-        platform_options = [
-            discord.SelectOption(label=platform[0]) for platform in platforms
-        ]
+    if not platforms:
+        await interaction.response.send_message("No platforms are available.", ephemeral=True)
+        return
 
-        # Dropdown for selecting the platform
-        class PlatformDropdown(Select):
-            def __init__(self):
-                super().__init__(
-                    placeholder="Select a platform",
-                    min_values=1,
-                    max_values=1,
-                    options=platform_options,
-                )
+    platform_options = [
+        discord.SelectOption(label=platform[0]) for platform in platforms
+    ]
 
-            async def callback(self, platform_interaction: Interaction):
-                selected_platform = self.values[0]
-
-                # Check if the user has an active key
-                async with aiosqlite.connect(DB_FILE) as db_check:
-                    async with db_check.execute(
-                        "SELECT expiration FROM keys WHERE user_id = ?", (user_id,)
-                    ) as cursor:
-                        key_data = await cursor.fetchone()
-                        if not key_data:
-                            await platform_interaction.response.send_message(
-                                "You don't have an active key! Activate a key first.", ephemeral=True
-                            )
-                            return
-
-                        expiration = key_data[0]
-                        if expiration and datetime.datetime.now() > datetime.datetime.fromisoformat(expiration):
-                            await platform_interaction.response.send_message(
-                                "Your key has expired! Activate a new key to continue.", ephemeral=True
-                            )
-                            return
-
-                # Delegate account generation to the shared handler
-                await handle_account_generation(platform_interaction, selected_platform)
-
-        view = View()
-        view.add_item(PlatformDropdown())
-        await interaction.response.send_message("Please select a platform:", view=view, ephemeral=True)
+    # timeout=None with only registered dynamic items: the view store keeps nothing per menu
+    view = View(timeout=None)
+    view.add_item(GeneratePlatformSelect(platform_options))
+    await interaction.response.send_message("Please select a platform:", view=view, ephemeral=True)
 
 @bot.tree.command(name="key_info", description="Check key information.")
 @app_commands.describe(key="The key to check information for (optional).")
 async def key_info(interaction: Interaction, key: str = None):
     user_id = interaction.user.id
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        if key:
-            # Fetch information about the provided key
-            async with db.execute("SELECT key, expiration, cooldown, user_id FROM keys WHERE key = ?", (key,)) as cursor:
-                key_data = await cursor.fetchone()
-                if not key_data:
-                    await interaction.response.send_message("The specified key does not exist.", ephemeral=True)
-                    return
-        else:
-            # Fetch information about the key assigned to the user
-            async with db.execute("SELECT key, expiration, cooldown, user_id FROM keys WHERE user_id = ?", (user_id,)) as cursor:
-                key_data = await cursor.fetchone()
-                if not key_data:
-                    await interaction.response.send_message("You do not have an active key.", ephemeral=True)
-                    return
-
-        # Extract key information
-        key_value, expiration, cooldown, owner_id = key_data
-
-        # Format expiration date
-        if expiration:
-            expiration_datetime = datetime.datetime.fromisoformat(expiration)
-            expiration_str = expiration_datetime.strftime("%m/%d/%y %H:%M")
-        else:
-            expiration_str = "Lifetime"
+    if key:
+        # Fetch information about the provided key
+        key_state = await key_cache.for_key(bot.stores.keys, key)
+        if key_state is None:
+            await interaction.response.send_message("The specified key does not exist.", ephemeral=True)
+            return
+    else:
+        # Fetch information about the key assigned to the user
+        key_state = await key_cache.for_user(bot.stores.keys, user_id)
+        if key_state is None:
+            await interaction.response.send_message("You do not have an active key.", ephemeral=True)
+            return
 
-        owner_info = "Unassigned" if not owner_id else f"<@{owner_id}>"
+    # Format expiration date
+    expiration_datetime = key_state.expiration_datetime()
+    expiration_str = "Lifetime" if expiration_datetime is None else expiration_datetime.strftime("%m/%d/%y %H:%M")
 
-        # Create the embed
-        embed = discord.Embed(
-            title="🔑 Key Information",
-            color=discord.Color.blue(),
-            timestamp=datetime.datetime.now()
-        )
-        embed.add_field(name="Key", value=f"`{key_value}`", inline=False)
-        embed.add_field(name="Expiration", value=f"`{expiration_str}`", inline=False)
-        embed.add_field(name="Cooldown", value=f"`{cooldown or 'None'}` seconds", inline=False)
-        embed.add_field(name="Assigned To", value=owner_info, inline=False)
-        embed.set_footer(text="Key Information Requested")
+    owner_info = "Unassigned" if not key_state.owner else f"<@{key_state.owner}>"
 
-        # Send the embed
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    # Create the embed
+    embed = discord.Embed(
+        title="🔑 Key Information",
+        color=discord.Color.blue(),
+        timestamp=datetime.datetime.now()
+    )
+    embed.add_field(name="Key", value=f"`{key_state.key}`", inline=False)
+    embed.add_field(name="Expiration", value=f"`{expiration_str}`", inline=False)
+    embed.add_field(name="Cooldown", value=f"`{key_state.cooldown or 'None'}` seconds", inline=False)
+    embed.add_field(name="Assigned To", value=owner_info, inline=False)
+    embed.set_footer(text="Key Information Requested")
+
+    # Send the embed
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 	
 @bot.tree.command(name="admin_user", description="Grants admin privileges to a user.")
 @app_commands.describe(user="The user to be granted admin privileges.")
+@admin_check()
 async def admin_user(interaction: Interaction, user: discord.User):
-    await admin_only(interaction)
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT OR IGNORE INTO admin_users (user_id) VALUES (?)", (user.id,))
-        await db.commit()
+    await bot.storage.add_admin_user(user.id)
 
     await interaction.response.send_message(f"{user.mention} has been added as an admin.", ephemeral=True)
 
 @bot.tree.command(name="admin_role", description="Grants admin privileges to a role.")
 @app_commands.describe(role="The role to be granted admin privileges.")
+@admin_check()
 async def admin_role(interaction: Interaction, role: discord.Role):
-    await admin_only(interaction)
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        await db.execute("INSERT OR IGNORE INTO admin_roles (role_id) VALUES (?)", (role.id,))
-        await db.commit()
+    await bot.storage.add_admin_role(role.id)
 
     await interaction.response.send_message(f"{role.name} has been added as an admin role.", ephemeral=True)
 	
 @bot.tree.command(name="blacklist", description="Bans a user from using the generator.")
 @app_commands.describe(user="The user to blacklist.")
+@admin_check()
 async def blacklist(interaction: Interaction, user: discord.User):
-    await admin_only(interaction)
-    user_id = user.id
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT user_id FROM blacklist WHERE user_id = ?", (user_id,)) as cursor:
-            data = await cursor.fetchone()
-        
-        if data:
-            await db.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
-            await db.commit()
-            await interaction.response.send_message(f"{user.name} has been removed from the blacklist.")
-        else:
-            await db.execute("INSERT INTO blacklist (user_id) VALUES (?)", (user_id,))
-            await db.commit()
-            await interaction.response.send_message(f"{user.name} has been added to the blacklist.")
+    # Toggles: a user already on the blacklist is taken off it
+    if await bot.stores.admins.remove_blacklisted(user.id):
+        await interaction.response.send_message(f"{user.name} has been removed from the blacklist.")
+    else:
+        await bot.stores.admins.add_blacklisted(user.id)
+        await interaction.response.send_message(f"{user.name} has been added to the blacklist.")
 
 @bot.tree.command(name="remove_blacklist", description="Removes a user from the blacklist.")
 @app_commands.describe(user="The user to remove from the blacklist.")
+@admin_check()
 async def remove_blacklist(interaction: Interaction, user: discord.User):
-    await admin_only(interaction)
-    user_id = user.id
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT user_id FROM blacklist WHERE user_id = ?", (user_id,)) as cursor:
-            data = await cursor.fetchone()
-        
-        if data:
-            await db.execute("DELETE FROM blacklist WHERE user_id = ?", (user_id,))
-            await db.commit()
-            await interaction.response.send_message(f"{user.name} has been removed from the blacklist.")
-        else:
-            await interaction.response.send_message(f"{user.name} is not in the blacklist.")
+    if await bot.stores.admins.remove_blacklisted(user.id):
+        await interaction.response.send_message(f"{user.name} has been removed from the blacklist.")
+    else:
+        await interaction.response.send_message(f"{user.name} is not in the blacklist.")
 
 @bot.tree.command(name="key-addtime", description="Add time to an existing key or make it lifetime.")
 async def key_addtime(interaction: discord.Interaction, amount: str, key: str):
@@ -575,19 +3747,13 @@ async def key_addtime(interaction: discord.Interaction, amount: str, key: str):
 
     # Handle "lifetime" conversion
     if amount.lower() == "lifetime":
-        async with aiosqlite.connect(DB_FILE) as db:
-            async with db.execute("SELECT expiration FROM keys WHERE key = ?", (key,)) as cursor:
-                key_data = await cursor.fetchone()
-
-            if not key_data:
-                await interaction.response.send_message(
-                    "Key not found. Please provide a valid key.", ephemeral=True
-                )
-                return
-
-            # Set expiration to None for lifetime
-            await db.execute("UPDATE keys SET expiration = NULL WHERE key = ?", (key,))
-            await db.commit()
+        # Set expiration to None for lifetime
+        found, owner_id = await bot.storage.make_lifetime(key)
+        if not found:
+            await interaction.response.send_message(
+                "Key not found. Please provide a valid key.", ephemeral=True
+            )
+            return
 
         await interaction.response.send_message(
             f"The key `{key}` has been updated to lifetime validity.", ephemeral=True
@@ -623,29 +3789,15 @@ async def key_addtime(interaction: discord.Interaction, amount: str, key: str):
         )
         return
 
-    # Update the key in the database
-    async with aiosqlite.connect(DB_FILE) as db:
-        async with db.execute("SELECT expiration FROM keys WHERE key = ?", (key,)) as cursor:
-            key_data = await cursor.fetchone()
-
-        if not key_data:
-            await interaction.response.send_message(
-                "Key not found. Please provide a valid key.", ephemeral=True
-            )
-            return
-
-        current_expiration = key_data[0]
-        if current_expiration:
-            new_expiration = datetime.datetime.fromisoformat(current_expiration) + delta
-        else:
-            new_expiration = datetime.datetime.now() + delta
-
-        # Update the key's expiration
-        await db.execute(
-            "UPDATE keys SET expiration = ? WHERE key = ?",
-            (new_expiration.isoformat(), key),
+    # Extend from the current expiration (or from now for lifetime keys) in one statement
+    seconds = int(delta.total_seconds())
+    found, expiration, owner_id = await bot.storage.extend(key, seconds, int(time.time()))
+    if not found:
+        await interaction.response.send_message(
+            "Key not found. Please provide a valid key.", ephemeral=True
         )
-        await db.commit()
+        return
+    new_expiration = datetime.datetime.fromtimestamp(expiration)
 
     # Send confirmation
     await interaction.response.send_message(
@@ -655,90 +3807,118 @@ async def key_addtime(interaction: discord.Interaction, amount: str, key: str):
 
 @bot.tree.command(name="edit_cooldown", description="Edit the cooldown of a key.")
 @app_commands.describe(key="The key to edit the cooldown for.", cooldown="The new cooldown in seconds.")
+@admin_check()
 async def edit_cooldown(interaction: Interaction, key: str, cooldown: int):
-    # Check if the user has admin permissions
-    user_id = interaction.user.id
-    user_roles = [role.id for role in interaction.user.roles] if interaction.guild else []
-
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Verify if the user is an admin user or has an admin role
-        async with db.execute("SELECT user_id FROM admin_users WHERE user_id = ?", (user_id,)) as cursor:
-            is_admin_user = await cursor.fetchone()
-
-        async with db.execute("SELECT role_id FROM admin_roles") as cursor:
-            admin_roles = await cursor.fetchall()
-            is_admin_role = any(role_id[0] in user_roles for role_id in admin_roles)
-
-        if not is_admin_user and not is_admin_role:
-            await interaction.response.send_message(
-                "You do not have permission to use this command.", ephemeral=True
-            )
-            return
-
-        # Check if the key exists
-        async with db.execute("SELECT key FROM keys WHERE key = ?", (key,)) as cursor:
-            key_exists = await cursor.fetchone()
-
-        if not key_exists:
-            await interaction.response.send_message("The specified key does not exist.", ephemeral=True)
-            return
-
-        # Update the cooldown for the key
-        await db.execute("UPDATE keys SET cooldown = ? WHERE key = ?", (cooldown, key))
-        await db.commit()
-
-        # Send a success message
-        embed = discord.Embed(
-            title="🔄 Cooldown Updated",
-            description=f"The cooldown for the key `{key}` has been updated to `{cooldown}` seconds.",
-            color=discord.Color.green()
-        )
-        embed.set_footer(text="Cooldown updated successfully.")
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+    # The backend also applies the new cooldown to a window the owner may already be in
+    existed, owner = await bot.storage.set_cooldown(key, cooldown)
 
-@bot.tree.command(name="keys_viewall", description="View all existing keys.")
-async def keys_viewall(interaction: Interaction):
-    # Check if the user has admin permissions
-    user_id = interaction.user.id
-    user_roles = [role.id for role in interaction.user.roles] if interaction.guild else []
+    # Check if the key exists
+    if not existed:
+        await interaction.response.send_message("The specified key does not exist.", ephemeral=True)
+        return
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        # Verify if the user is an admin user or has an admin role
-        async with db.execute("SELECT user_id FROM admin_users WHERE user_id = ?", (user_id,)) as cursor:
-            is_admin_user = await cursor.fetchone()
+    # Send a success message
+    embed = discord.Embed(
+        title="🔄 Cooldown Updated",
+        description=f"The cooldown for the key `{key}` has been updated to `{cooldown}` seconds.",
+        color=discord.Color.green()
+    )
+    embed.set_footer(text="Cooldown updated successfully.")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+KEYS_PER_PAGE = 10
+KEY_COUNT_TTL = 30.0
+
+# (status, user_id) -> (counted_at, total), so paging through keys does not recount the table
+_key_counts: dict[tuple[str, int | None], tuple[float, int]] = {}
+
+async def count_keys(store: KeyStore, status: str, user_id: int | None) -> int:
+    cached = _key_counts.get((status, user_id))
+    if cached is not None and time.monotonic() - cached[0] < KEY_COUNT_TTL:
+        return cached[1]
+    total = await store.count(status, user_id, int(time.time()))
+    _key_counts[(status, user_id)] = (time.monotonic(), total)
+    return total
+
+async def fetch_key_page(store: KeyStore, status: str, user_id: int | None,
+                         after: str | None = None, before: str | None = None) -> list:
+    """Keyset pagination over keys: the page after `after`, or the page before `before`."""
+    return await store.page(status, user_id, int(time.time()), after, before, KEYS_PER_PAGE)
+
+class KeysPageButton(discord.ui.DynamicItem[Button],
+                     template=r"keys:(?P<direction>prev|next):(?P<status>all|unassigned|expired):(?P<user_id>\d+):(?P<page>\d+):(?P<cursor>.+)"):
+    """
+    Previous/Next for a keys_viewall page. The filter, page number and keyset cursor live in
+    the custom_id, so a click is served by refetching one page and nothing is kept between clicks.
+    """
 
-        async with db.execute("SELECT role_id FROM admin_roles") as cursor:
-            admin_roles = await cursor.fetchall()
-            is_admin_role = any(role_id[0] in user_roles for role_id in admin_roles)
+    def __init__(self, direction: str, status: str, user_id: int | None, page: int, cursor: str, disabled: bool = False):
+        custom_id = f"keys:{direction}:{status}:{user_id or 0}:{page}:{cursor}"
+        # custom_ids are capped at 100 characters; minted keys leave plenty of room
+        super().__init__(Button(
+            label="Previous" if direction == "prev" else "Next",
+            style=discord.ButtonStyle.blurple,
+            custom_id=custom_id[:100],
+            disabled=disabled or len(custom_id) > 100,
+        ))
+        self.direction = direction
+        self.status = status
+        self.user_id = user_id
+        self.page = page
+        self.cursor = cursor
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: Button, match: re.Match):
+        return cls(match["direction"], match["status"], int(match["user_id"]) or None, int(match["page"]), match["cursor"])
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        # The list is posted publicly, but only admins may page through it
+        if is_admin(interaction):
+            return True
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return False
 
-        if not is_admin_user and not is_admin_role:
-            await interaction.response.send_message(
-                "You do not have permission to use this command.", ephemeral=True
-            )
+    async def callback(self, interaction: Interaction):
+        if self.direction == "next":
+            rows, page = await fetch_key_page(bot.stores.keys, self.status, self.user_id, after=self.cursor), self.page + 1
+        else:
+            rows, page = await fetch_key_page(bot.stores.keys, self.status, self.user_id, before=self.cursor), self.page - 1
+        if not rows:
+            await interaction.response.defer()
             return
-
-        # Fetch all keys
-        async with db.execute("SELECT key, expiration, cooldown, user_id FROM keys") as cursor:
-            keys = await cursor.fetchall()
-
-    if not keys:
-        await interaction.response.send_message("There are no keys available.", ephemeral=True)
-        return
-
-    # Pagination Logic
-    keys_per_page = 10
-    total_pages = (len(keys) + keys_per_page - 1) // keys_per_page
-
-    def create_embed(page: int):
+        total = await count_keys(bot.stores.keys, self.status, self.user_id)
+        view = KeysView(self.status, self.user_id, total, rows, page)
+        await interaction.response.edit_message(embed=view.create_embed(), view=view)
+
+class KeysView(View):
+    """One rendered page of keys. Its buttons carry all paging state, so the view is never stored."""
+
+    def __init__(self, status: str, user_id: int | None, total: int, rows: list, page: int = 1):
+        super().__init__(timeout=None)
+        self.status = status
+        self.user_id = user_id
+        self.total = total
+        self.rows = rows
+        self.page = page
+        self.previous_page = KeysPageButton("prev", status, user_id, page, rows[0][0], disabled=page <= 1)
+        self.next_page = KeysPageButton("next", status, user_id, page, rows[-1][0], disabled=len(rows) < KEYS_PER_PAGE)
+        self.add_item(self.previous_page)
+        self.add_item(self.next_page)
+
+    @property
+    def total_pages(self) -> int:
+        # The total is cached, so never report fewer pages than we have walked through
+        return max(self.page, (self.total + KEYS_PER_PAGE - 1) // KEYS_PER_PAGE)
+
+    def create_embed(self) -> discord.Embed:
+        title = "All Keys" if self.status == "all" else f"{self.status.capitalize()} Keys"
         embed = discord.Embed(
-            title=f"🔑 All Keys (Page {page}/{total_pages})",
-            description="List of all keys:",
+            title=f"🔑 {title} (Page {self.page}/{self.total_pages})",
+            description=f"{self.total} key(s){f' assigned to <@{self.user_id}>' if self.user_id else ''}:",
             color=discord.Color.blue()
         )
-        start_index = (page - 1) * keys_per_page
-        end_index = start_index + keys_per_page
-        for key, expiration, cooldown, user_id in keys[start_index:end_index]:
-            expiration_str = "Never" if not expiration else datetime.datetime.fromisoformat(expiration).strftime("%m/%d/%y %H:%M")
+        for key, expiration, cooldown, user_id in self.rows:
+            expiration_str = "Never" if not expiration else datetime.datetime.fromtimestamp(expiration).strftime("%m/%d/%y %H:%M")
             user_str = "Unassigned" if not user_id else f"<@{user_id}>"
             embed.add_field(
                 name=f"Key: `{key}`",
@@ -748,38 +3928,592 @@ async def keys_viewall(interaction: Interaction):
         embed.set_footer(text="Use the buttons below to navigate pages.")
         return embed
 
-    # Button View for Pagination
-    class KeysView(View):
-        def __init__(self):
-            super().__init__()
-            self.page = 1
-
-        async def update_message(self, interaction: Interaction):
-            embed = create_embed(self.page)
-            await interaction.response.edit_message(embed=embed, view=self)
+# Components dispatched by custom_id template. Registered once at startup, they serve clicks on
+# any message that carries them, including menus sent before a restart.
+PERSISTENT_COMPONENTS = (GeneratePlatformSelect, BulkAddPlatformSelect, DurationDropdown, KeysPageButton)
 
-        @discord.ui.button(label="Previous", style=discord.ButtonStyle.blurple)
-        async def previous_page(self, interaction: Interaction, button: Button):
-            if self.page > 1:
-                self.page -= 1
-                await self.update_message(interaction)
+# Components run through command_executor: (priority, replies with a new message rather than
+# editing the one clicked). DurationDropdown answers with a modal, which cannot follow a defer
+COMPONENT_PRIORITIES = {
+    GeneratePlatformSelect: (PRIORITY_INTERACTIVE, True),
+    BulkAddPlatformSelect: (PRIORITY_BULK, False),
+    KeysPageButton: (PRIORITY_BULK, False),
+}
 
-        @discord.ui.button(label="Next", style=discord.ButtonStyle.blurple)
-        async def next_page(self, interaction: Interaction, button: Button):
-            if self.page < total_pages:
-                self.page += 1
-                await self.update_message(interaction)
+@bot.tree.command(name="keys_viewall", description="View all existing keys.")
+@app_commands.describe(status="Which keys to list.", user="Only list keys assigned to this user.")
+@app_commands.choices(status=[
+    app_commands.Choice(name="All", value="all"),
+    app_commands.Choice(name="Unassigned", value="unassigned"),
+    app_commands.Choice(name="Expired", value="expired"),
+])
+@admin_check()
+async def keys_viewall(interaction: Interaction, status: str = "all", user: discord.User = None):
+    user_id = user.id if user else None
+    total = await count_keys(bot.stores.keys, status, user_id)
+    rows = await fetch_key_page(bot.stores.keys, status, user_id)
+
+    if not rows:
+        await interaction.response.send_message("There are no keys available.", ephemeral=True)
+        return
 
     # Send initial embed and view
-    embed = create_embed(1)
-    view = KeysView()
-    await interaction.response.send_message(embed=embed)
+    view = KeysView(status, user_id, total, rows)
+    await interaction.response.send_message(embed=view.create_embed(), view=view)
+
+# Background jobs: long admin operations run here in resumable chunks instead of inside the
+# interaction handler. Each chunk is its own short transaction, followed by a checkpoint
+JOB_POLL_INTERVAL = 5.0
+JOB_PROGRESS_INTERVAL = 2.0
+JOB_KEY_BATCH_SIZE = 5000
+JOB_REVOKE_BATCH_SIZE = 500
+# Finished jobs and their output are deleted this long after they end
+JOB_RETENTION = 14 * 86400
+JOB_PRUNE_INTERVAL = 3600
+JOB_STATUS_COLORS = {
+    "queued": discord.Color.blue(),
+    "running": discord.Color.blue(),
+    "done": discord.Color.green(),
+    "failed": discord.Color.red(),
+    "cancelled": discord.Color.greyple(),
+}
+
+class JobCancelled(Exception):
+    """Raised at a checkpoint once the running job has been cancelled."""
+
+class Job:
+    """One row of the jobs table. `state` is the handler's checkpoint, saved after every chunk."""
+
+    COLUMNS = "id, kind, status, params, state, progress, total, created_by, channel_id, message_id, error, created_at"
+
+    def __init__(self, job_id: int, kind: str, status: str, params: dict, state: dict, progress: int,
+                 total: int | None, created_by: int, channel_id: int | None, message_id: int | None,
+                 error: str | None, created_at: int):
+        self.id = job_id
+        self.kind = kind
+        self.status = status
+        self.params = params
+        self.state = state
+        self.progress = progress
+        self.total = total
+        self.created_by = created_by
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.error = error
+        self.created_at = created_at
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        return cls(row[0], row[1], row[2], json.loads(row[3]), json.loads(row[4]), *row[5:])
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+class JobStore:
+    """
+    The jobs table, plus job_items: a job's bulk input or output (such as keys), appended
+    in order and never rewritten. Status changes are guarded, so a cancel from any process
+    wins over the runner.
+    """
+
+    def __init__(self, pool: DatabasePool):
+        self.pool = pool
+
+    async def create(self, kind: str, params: dict, created_by: int, total: int | None = None,
+                     items: list[str] = ()) -> Job:
+        now = int(time.time())
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                "INSERT INTO jobs (kind, status, params, total, created_by, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?) RETURNING id",
+                (kind, json.dumps(params), total, created_by, now, now)
+            ) as cursor:
+                job_id = (await cursor.fetchone())[0]
+            await db.executemany(
+                "INSERT INTO job_items (job_id, seq, item) VALUES (?, ?, ?)",
+                ((job_id, seq, item) for seq, item in enumerate(items))
+            )
+            await db.commit()
+        return Job(job_id, kind, "queued", params, {}, 0, total, created_by, None, None, None, now)
+
+    async def items(self, job_id: int, offset: int = 0, limit: int = -1) -> list[str]:
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT item FROM job_items WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?", (job_id, offset, limit)
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def set_message(self, job: Job, channel_id: int, message_id: int):
+        job.channel_id, job.message_id = channel_id, message_id
+        async with self.pool.write() as db:
+            await db.execute("UPDATE jobs SET channel_id = ?, message_id = ? WHERE id = ?", (channel_id, message_id, job.id))
+            await db.commit()
+
+    async def get(self, job_id: int) -> Job | None:
+        async with self.pool.read() as db:
+            async with db.execute(f"SELECT {Job.COLUMNS} FROM jobs WHERE id = ?", (job_id,)) as cursor:
+                row = await cursor.fetchone()
+        return None if row is None else Job.from_row(row)
+
+    async def recent(self, limit: int = 10) -> list[Job]:
+        async with self.pool.read() as db:
+            async with db.execute(f"SELECT {Job.COLUMNS} FROM jobs ORDER BY id DESC LIMIT ?", (limit,)) as cursor:
+                return [Job.from_row(row) for row in await cursor.fetchall()]
+
+    async def next_runnable(self) -> Job | None:
+        """The job to run next: one interrupted mid-run by a restart, else the oldest queued."""
+        async with self.pool.read() as db:
+            async with db.execute(
+                f"SELECT {Job.COLUMNS} FROM jobs WHERE status IN ('running', 'queued') "
+                "ORDER BY status = 'running' DESC, id LIMIT 1"
+            ) as cursor:
+                row = await cursor.fetchone()
+        return None if row is None else Job.from_row(row)
+
+    async def _update(self, sql: str, params: tuple) -> bool:
+        async with self.pool.write() as db:
+            async with db.execute(sql, params) as cursor:
+                changed = cursor.rowcount > 0
+            await db.commit()
+        return changed
+
+    async def start(self, job: Job) -> bool:
+        """Marks a queued job running. Returns False if it was cancelled first."""
+        job.status = "running"
+        return await self._update(
+            "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (int(time.time()), job.id)
+        )
+
+    async def save(self, job: Job, items: list[str] = (), write=None) -> bool:
+        """Checkpoints a running job, appending `items` to its output in the same transaction.
+        `write(db)`, if given, runs first in that transaction and may update the job.
+        Returns False once it has been cancelled; the chunk that noticed is still recorded."""
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if write is not None:
+                await write(db)
+            async with db.execute(
+                "UPDATE jobs SET state = ?, progress = ?, updated_at = ? WHERE id = ? AND status IN ('running', 'cancelled') "
+                "RETURNING status",
+                (json.dumps(job.state), job.progress, int(time.time()), job.id)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and items:
+                async with db.execute("SELECT COALESCE(MAX(seq), -1) + 1 FROM job_items WHERE job_id = ?", (job.id,)) as cursor:
+                    start = (await cursor.fetchone())[0]
+                await db.executemany(
+                    "INSERT INTO job_items (job_id, seq, item) VALUES (?, ?, ?)",
+                    ((job.id, seq, item) for seq, item in enumerate(items, start=start))
+                )
+            await db.commit()
+        return row is not None and row[0] == "running"
+
+    async def finish(self, job: Job, status: str, error: str | None = None):
+        job.status, job.error = status, error
+        await self._update(
+            "UPDATE jobs SET status = ?, state = ?, progress = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(job.state), job.progress, error, int(time.time()), job.id)
+        )
+
+    async def cancel(self, job_id: int) -> Job | None:
+        """Cancels a queued or running job. Returns it as it was before, or None if it was not active."""
+        job = await self.get(job_id)
+        if job is None or not job.active:
+            return None
+        if not await self._update(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (int(time.time()), job_id)
+        ):
+            return None
+        return job
+
+    async def prune(self, before: int) -> int:
+        """Deletes jobs that finished before `before`, with their items. Returns how many jobs went."""
+        async with self.pool.write() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            finished = "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?"
+            await db.execute(f"DELETE FROM job_items WHERE job_id IN ({finished})", (before,))
+            async with db.execute(f"DELETE FROM jobs WHERE id IN ({finished})", (before,)) as cursor:
+                pruned = cursor.rowcount
+            await db.commit()
+        return pruned
+
+class JobKind:
+    """How one kind of job runs, and how its progress message reads."""
+
+    title = ""
+
+    async def run(self, job: Job, checkpoint):
+        """Does the work in chunks, updating job.state and job.progress and awaiting
+        checkpoint(items) after each one, with any output the chunk produced. A chunk that
+        writes to the jobs database can instead pass checkpoint(write=...) to commit with it
+        (see JobStore.save). On a resumed job, starts from job.state."""
+        raise NotImplementedError
+
+    def describe(self, job: Job) -> str:
+        raise NotImplementedError
+
+    async def files(self, job: Job) -> list[discord.File]:
+        return []
+
+class BulkAddJob(JobKind):
+    title = "Bulk add"
+
+    def _report(self, job: Job) -> IngestReport:
+        report = IngestReport(job.params["platform"])
+        for field in IngestReport.COUNTS:
+            setattr(report, field, job.state.get(field, 0))
+        return report
+
+    async def run(self, job, checkpoint):
+        report = self._report(job)
+        resume_at = report.lines
+
+        async def remaining_lines():
+            # The CDN stream restarts from the top; lines already imported are skipped
+            seen = 0
+            async for line in decode_lines(attachment_chunks(job.params["url"])):
+                seen += 1
+                if seen > resume_at:
+                    yield line
+
+        async def save(report: IngestReport):
+            job.state = {field: getattr(report, field) for field in IngestReport.COUNTS}
+            job.progress = report.lines
+            await checkpoint()
+
+        async def stock(batch: list[str], report: IngestReport):
+            async def write(db):
+                added = await SqliteAccountStore.insert_new_accounts(db, report.platform, list(dict.fromkeys(batch)))
+                report.added += added
+                report.duplicates += len(batch) - added
+                job.state = {field: getattr(report, field) for field in IngestReport.COUNTS}
+                job.progress = report.lines
+            await checkpoint(write=write)
+
+        accounts = bot.stores.accounts
+        if isinstance(accounts, SqliteAccountStore) and accounts.pool is bot.job_store.pool:
+            # Each batch commits with its checkpoint, so a restart never replays stocked lines
+            # (which would then be counted as duplicates)
+            await ingest_accounts(accounts, report.platform, remaining_lines(), report=report, stock=stock)
+        else:
+            # Stock in Postgres commits apart from the jobs table: a batch stocked just before a
+            # restart is replayed and counted as duplicates
+            await ingest_accounts(accounts, report.platform, remaining_lines(), on_progress=save, report=report)
+        job.state = {field: getattr(report, field) for field in IngestReport.COUNTS}
+        job.progress = report.lines
+
+    def describe(self, job):
+        report = self._report(job)
+        skipped = report.duplicates + report.invalid + report.blank
+        if job.status == "done":
+            return (f"Added **{report.added}** accounts to {report.platform} from `{job.params['filename']}`.\n"
+                    f"Skipped {report.duplicates} duplicate, {report.invalid} invalid and {report.blank} blank lines.")
+        return (f"Importing `{job.params['filename']}` into {report.platform}: "
+                f"{report.added} added, {skipped} skipped so far.")
+
+class BulkKeyJob(JobKind):
+    """Inserts keys minted when the job was queued (its items), so a resumed job creates exactly those keys."""
+
+    title = "Bulk key creation"
+
+    async def run(self, job, checkpoint):
+        params = job.params
+        expiration = datetime.datetime.fromtimestamp(params["expiration"])
+        while batch := await bot.job_store.items(job.id, job.progress, JOB_KEY_BATCH_SIZE):
+            await bot.storage.insert_keys(batch, expiration, params["duration"], params["cooldown"])
+            job.progress += len(batch)
+            await checkpoint()
+
+    def describe(self, job):
+        params = job.params
+        if job.status == "done":
+            return (f"Successfully generated {job.total} keys. They are attached as `keys.txt`.\n"
+                    f"Valid for {params['duration']}, {params['cooldown']} seconds cooldown.")
+        return f"Created {job.progress} of {job.total} keys valid for {params['duration']}."
+
+    async def files(self, job):
+        if job.status != "done":
+            return []
+        keys = await bot.job_store.items(job.id)
+        return [discord.File(io.BytesIO("\n".join(keys).encode("utf-8")), filename="keys.txt")]
+
+class RevokeUserJob(JobKind):
+    title = "Key revocation"
+    # Keys listed in the final message; the rest are summarized as a count
+    SHOWN_KEYS = 50
+
+    async def run(self, job, checkpoint):
+        user_id = job.params["user_id"]
+        # Only the keys listed in the message stay in the state; the full list goes to the job's items
+        shown = job.state.setdefault("shown", [])
+        while batch := await bot.storage.revoke_user_batch(user_id, JOB_REVOKE_BATCH_SIZE):
+            shown.extend(batch[:self.SHOWN_KEYS - len(shown)])
+            job.progress += len(batch)
+            await checkpoint(batch)
+
+    def describe(self, job):
+        user = f"<@{job.params['user_id']}>"
+        if job.status != "done":
+            return f"Revoked {job.progress} key(s) from {user} so far."
+        if not job.progress:
+            return f"No keys are currently assigned to {user}."
+        shown = ", ".join(f"`{key}`" for key in job.state["shown"])
+        more = f" and {job.progress - self.SHOWN_KEYS} more (attached)" if job.progress > self.SHOWN_KEYS else ""
+        return f"The following keys have been revoked from {user}: {shown}{more}"
+
+    async def files(self, job):
+        if job.status != "done" or job.progress <= self.SHOWN_KEYS:
+            return []
+        revoked = await bot.job_store.items(job.id)
+        return [discord.File(io.BytesIO("\n".join(revoked).encode("utf-8")), filename="revoked.txt")]
+
+JOB_KINDS = {
+    "bulk_add": BulkAddJob(),
+    "bulk_key_create": BulkKeyJob(),
+    "revoke_user": RevokeUserJob(),
+}
+
+def job_embed(job: Job) -> discord.Embed:
+    embed = discord.Embed(
+        title=f"Job #{job.id}: {JOB_KINDS[job.kind].title}",
+        description=JOB_KINDS[job.kind].describe(job),
+        color=JOB_STATUS_COLORS[job.status],
+    )
+    footer = f"Status: {job.status}"
+    if job.error:
+        footer += f" ({job.error})"
+    elif job.active:
+        footer += f" · cancel with /jobs cancel:{job.id}"
+    embed.set_footer(text=footer)
+    return embed
+
+async def edit_job_message(job: Job, embed: discord.Embed, files: list[discord.File]):
+    """Edits the job's progress message over REST, so it works after a restart and from any shard."""
+    if job.message_id is None:
+        return
+    message = bot.get_partial_messageable(job.channel_id).get_partial_message(job.message_id)
+    try:
+        if files:
+            await message.edit(embed=embed, attachments=files)
+        else:
+            await message.edit(embed=embed)
+    except discord.HTTPException as e:
+        print(f"Could not update the message for job #{job.id}: {e}")
+
+class JobRunner:
+    """
+    Runs jobs one at a time in a background task, oldest first, after resuming any job a
+    restart interrupted. Between chunks the runner checkpoints the job (which is where a
+    cancel is noticed), throttles progress edits and yields to other tasks.
+    """
+
+    def __init__(self, store: JobStore, publish=edit_job_message):
+        self.store = store
+        self.publish = publish
+        self._wake = asyncio.Event()
+        self._task = None
+        self._pruned_at = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def announce(self, job: Job):
+        await self.publish(job, job_embed(job), await JOB_KINDS[job.kind].files(job))
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.run_pending()
+                if self._pruned_at is None or time.monotonic() - self._pruned_at >= JOB_PRUNE_INTERVAL:
+                    self._pruned_at = time.monotonic()
+                    pruned = await self.store.prune(int(time.time()) - JOB_RETENTION)
+                    if pruned:
+                        print(f"Pruned {pruned} finished job(s).")
+            except Exception:
+                traceback.print_exc()
+            try:
+                # Jobs queued by other shard processes are only noticed by polling
+                await asyncio.wait_for(self._wake.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pending(self):
+        """Runs jobs until none are queued."""
+        while (job := await self.store.next_runnable()) is not None:
+            await self.run_job(job)
+
+    async def run_job(self, job: Job):
+        if job.status == "running":
+            print(f"Resuming job #{job.id} ({job.kind}) at {job.progress}.")
+        if not await self.store.start(job):
+            return
+        last_publish = time.monotonic()
+
+        async def checkpoint(items: list[str] = (), write=None):
+            nonlocal last_publish
+            if not await self.store.save(job, items, write):
+                raise JobCancelled()
+            # Edits are rate limited, so only refresh the message every few seconds
+            if time.monotonic() - last_publish >= JOB_PROGRESS_INTERVAL:
+                last_publish = time.monotonic()
+                await self.announce(job)
+            # Let queued commands take the write lock before the next chunk
+            await asyncio.sleep(0)
+
+        try:
+            await JOB_KINDS[job.kind].run(job, checkpoint)
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"Job #{job.id} ({job.kind}) failed:")
+            traceback.print_exception(type(e), e, e.__traceback__)
+            await self.store.finish(job, "failed", str(e) or type(e).__name__)
+        else:
+            await self.store.finish(job, "done")
+        await self.announce(job)
+
+async def submit_job(kind: str, params: dict, created_by: int, destination, total: int | None = None,
+                     items: list[str] = (), fallback=None) -> Job:
+    """Queues a job and posts its progress message to `destination` (a channel or context),
+    or to `fallback` if that refuses the message (a user who does not accept DMs)."""
+    job = await bot.job_store.create(kind, params, created_by, total, items)
+    try:
+        message = await destination.send(embed=job_embed(job))
+    except discord.Forbidden:
+        if fallback is None:
+            raise
+        message = await fallback.send(embed=job_embed(job))
+    await bot.job_store.set_message(job, message.channel.id, message.id)
+    bot.jobs.wake()
+    return job
+
+@bot.tree.command(name="jobs", description="List background jobs, or cancel one (Admin only).")
+@app_commands.describe(cancel="ID of a queued or running job to cancel.")
+@admin_check()
+async def jobs(interaction: Interaction, cancel: int = None):
+    if cancel is not None:
+        job = await bot.job_store.cancel(cancel)
+        if job is None:
+            await interaction.response.send_message(f"Job #{cancel} is not queued or running.", ephemeral=True)
+            return
+        if job.status == "queued":
+            # A running job is stopped at its next checkpoint, and the runner posts the result
+            job.status = "cancelled"
+            await bot.jobs.announce(job)
+        await interaction.response.send_message(f"Job #{cancel} has been cancelled.", ephemeral=True)
+        return
+
+    recent = await bot.job_store.recent()
+    if not recent:
+        await interaction.response.send_message("There are no background jobs.", ephemeral=True)
+        return
+    embed = discord.Embed(title="Background Jobs", color=discord.Color.blue())
+    for job in recent:
+        progress = f"{job.progress}/{job.total}" if job.total else str(job.progress)
+        embed.add_field(
+            name=f"#{job.id} {JOB_KINDS[job.kind].title}",
+            value=f"**Status:** {job.status}\n**Progress:** {progress}\n**Started by:** <@{job.created_by}> <t:{job.created_at}:R>",
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# Exports are written to a spooled file, which moves to disk past this size
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_PAGE_SIZE = 1000
+# Discord's attachment limit for bots in unboosted guilds
+EXPORT_MAX_BYTES = 25 * 1024 * 1024
+
+async def export_keys(stores: Stores):
+    yield ("key", "expiration", "cooldown", "user_id")
+    now, after = int(time.time()), None
+    while rows := await stores.keys.page("all", None, now, after=after, limit=EXPORT_PAGE_SIZE):
+        for row in rows:
+            yield row
+        after = rows[-1][0]
+
+async def export_stats(stores: Stores):
+    yield ("user_id", "generated_count")
+    after = 0
+    while rows := await stores.stats.generated_page(after, EXPORT_PAGE_SIZE):
+        for row in rows:
+            yield row
+        after = rows[-1][0]
+
+async def export_inventory(stores: Stores):
+    yield ("platform", "available")
+    for row in await stores.accounts.inventory():
+        yield row
+
+EXPORTS = {
+    "keys": export_keys,
+    "stats": export_stats,
+    "inventory": export_inventory,
+}
+
+async def write_csv_gz(rows, fileobj) -> int:
+    """Writes rows from an async iterator to `fileobj` as gzip-compressed CSV. Returns the number of rows."""
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        writer = csv.writer(text)
+        async for row in rows:
+            writer.writerow(row)
+            count += 1
+        text.flush()
+        # Leave closing the gzip stream to the with block
+        text.detach()
+    return count
+
+@bot.tree.command(name="export", description="Download keys, stats or inventory as a compressed CSV (Admin only).")
+@app_commands.describe(dataset="What to export.")
+@app_commands.choices(dataset=[
+    app_commands.Choice(name="Keys", value="keys"),
+    app_commands.Choice(name="Stats", value="stats"),
+    app_commands.Choice(name="Inventory", value="inventory"),
+])
+@admin_check()
+async def export_data(interaction: Interaction, dataset: str):
+    if dataset == "stats":
+        await generated_stats_buffer.flush(bot.stores.stats)
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as spool:
+        rows = await write_csv_gz(EXPORTS[dataset](bot.stores), spool)
+        size = spool.tell()
+        if size > EXPORT_MAX_BYTES:
+            await interaction.response.send_message(
+                f"The {dataset} export is {size / 1024 / 1024:.1f}MB compressed, over Discord's upload limit.", ephemeral=True
+            )
+            return
+        spool.seek(0)
+        filename = f"{dataset}-{datetime.datetime.now():%Y%m%d-%H%M%S}.csv.gz"
+        await interaction.response.send_message(
+            f"Exported {rows - 1} {dataset} row(s).", file=discord.File(spool, filename=filename), ephemeral=True
+        )
 
 @bot.command(name="bulk-key-create")
 async def bulk_key_create(ctx, amount: int, duration: str, cooldown: int):
     if amount <= 0:
         await ctx.send("Please specify a positive number of keys to generate.")
         return
+    if amount > MAX_BULK_KEYS:
+        await ctx.send(f"You can generate at most {MAX_BULK_KEYS} keys at once.")
+        return
     if cooldown < 0:
         await ctx.send("Cooldown must be a non-negative integer.")
         return
@@ -799,41 +4533,21 @@ async def bulk_key_create(ctx, amount: int, duration: str, cooldown: int):
         if unit not in time_units:
             raise ValueError("Invalid duration unit.")
         if unit == 'y':
-            expiration = datetime.utcnow() + timedelta(days=365 * value)
+            expiration = datetime.datetime.now() + timedelta(days=365 * value)
         else:
             kwargs = {time_units[unit]: value}
-            expiration = datetime.utcnow() + timedelta(**kwargs)
+            expiration = datetime.datetime.now() + timedelta(**kwargs)
     except (ValueError, TypeError):
         await ctx.send("Invalid duration format. Use formats like `1d`, `30m`, or `2y`.")
         return
 
-    # Generate keys and insert them into the database
-    new_keys = []
-    async with aiosqlite.connect(DB_FILE) as db:
-        for _ in range(amount):
-            key = str(uuid.uuid4())  # Generate a random unique key
-            await db.execute(
-                "INSERT INTO keys (key, expiration, cooldown) VALUES (?, ?, ?)",
-                (key, expiration.isoformat(), cooldown)
-            )
-            new_keys.append(key)
-        await db.commit()
-
-    # Display keys in an embed
-    embed = discord.Embed(
-        title="Bulk Key Creation",
-        description=f"Successfully generated {amount} keys.",
-        color=discord.Color.blue()
-    )
-    embed.add_field(name="Duration", value=f"Valid for {duration}", inline=True)
-    embed.add_field(name="Cooldown", value=f"{cooldown} seconds", inline=True)
-
-    # Show up to 5 keys per field to keep the embed readable
-    for i in range(0, len(new_keys), 5):
-        keys_batch = "\n".join(new_keys[i:i + 5])
-        embed.add_field(name="Keys", value=keys_batch, inline=False)
-
-    await ctx.send(embed=embed)
+    # Mint the keys now and insert them in the background; the finished job attaches them as a file
+    params = {
+        "expiration": int(expiration.timestamp()),
+        "duration": duration,
+        "cooldown": cooldown,
+    }
+    await submit_job("bulk_key_create", params, ctx.author.id, ctx, total=amount, items=mint_keys(amount))
 
 
 @bot.command(name="revoke-key")
@@ -842,33 +4556,32 @@ async def revoke_key(ctx, key: str = None, user: discord.User = None):
         await ctx.send("You must specify either a key or a user to revoke.")
         return
 
-    async with aiosqlite.connect(DB_FILE) as db:
-        if key:
-            # Revoke the specific key
-            result = await db.execute("SELECT * FROM keys WHERE key = ?", (key,))
-            key_data = await result.fetchone()
-
-            if key_data:
-                await db.execute("DELETE FROM keys WHERE key = ?", (key,))
-                await db.commit()
-                await ctx.send(f"The key `{key}` has been successfully revoked.")
-            else:
-                await ctx.send(f"The key `{key}` does not exist.")
-        elif user:
-            # Revoke all keys assigned to the user
-            result = await db.execute("SELECT key FROM keys WHERE user_id = ?", (user.id,))
-            keys_to_revoke = await result.fetchall()
-
-            if keys_to_revoke:
-                await db.execute("DELETE FROM keys WHERE user_id = ?", (user.id,))
-                await db.commit()
-                revoked_keys = ", ".join([key[0] for key in keys_to_revoke])
-                await ctx.send(f"The following keys have been revoked from {user.mention}: {revoked_keys}")
-            else:
-                await ctx.send(f"No keys are currently assigned to {user.mention}.")
+    if key:
+        # Revoke the specific key
+        existed, owner = await bot.storage.revoke_key(key)
+        if existed:
+            await ctx.send(f"The key `{key}` has been successfully revoked.")
+        else:
+            await ctx.send(f"The key `{key}` does not exist.")
+    elif user:
+        # Revoke all keys assigned to the user, in batches
+        await submit_job("revoke_user", {"user_id": user.id}, ctx.author.id, ctx)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discord account generator bot.")
+    parser.add_argument("mode", nargs="?", choices=("bot", "coordinator"), default="bot",
+                        help="run a bot (or shard) process, or the coordinator that owns the database")
+    parser.add_argument("--db", default=DB_FILE, help=f"SQLite database file (default: {DB_FILE})")
+    parser.add_argument("--socket", default=COORDINATOR_SOCKET, help=f"coordinator socket (default: {COORDINATOR_SOCKET})")
+    args = parser.parse_args()
+
+    if args.mode == "coordinator":
+        asyncio.run(run_coordinator(args.db, args.socket))
+        sys.exit(0)
+    bot.db = DatabasePool(args.db)
+    COORDINATOR_SOCKET = args.socket
+
     # Load the bot token from a file or environment variable
     try:
         with open("config/token.txt", "r") as token_file:
@@ -880,4 +4593,5 @@ if __name__ == "__main__":
 
 
     # Start the bot
+    bot.startup.mark("import")
     bot.run(TOKEN)